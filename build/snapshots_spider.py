@@ -1,4 +1,4 @@
-"""DEPRECATED (use newsroom tooling for downloading snapshots)"""
+"""DEPRECATED (use newsroom-cdx for collecting snapshots)"""
 import gzip
 import json
 import logging
@@ -1,4 +1,5 @@
 from argparse import Namespace
+from collections import Counter
 from os.path import exists
 from urllib.parse import urlparse
 
@@ -6,6 +7,7 @@ import regex as re  # stdlib module doesn't support \p{L}
 from tqdm import tqdm
 
 from newsroom import jsonl
+from newsroom.build import Article
 
 #############
 # Constants #
@@ -13,6 +15,10 @@ from newsroom import jsonl
 
 ASSET_FILES = set(["css", "js", "png", "eot", "tff", "woff", "svg", "jpg", "bmp"])
 
+# CDX "length" is the size of the compressed archive record, so this is
+# roughly 5 MB of HTML, the default --max-size of newsroom-scrape.
+MAX_LENGTH = 1_000_000
+
 #############
 # /Constants #
 #############
@@ -32,10 +38,12 @@ def split_dataset(dataset: str, thin_dev: str, thin_test: str):
         assert not exists(filename), "output file (%s) already exist." % filename
 
     with jsonl.open(thin_dev, gzip=True) as dev_fh:
-        dev_ids = set(doc["archive"] for doc in tqdm(dev_fh))
+        dev_docs = dev_fh.readlines(keys=["archive"])
+        dev_ids = set(doc["archive"] for doc in tqdm(dev_docs))
 
     with jsonl.open(thin_test, gzip=True) as test_fh:
-        test_ids = set(doc["archive"] for doc in tqdm(test_fh))
+        test_docs = test_fh.readlines(keys=["archive"])
+        test_ids = set(doc["archive"] for doc in tqdm(test_docs))
 
     # Disable formatter as it messes up formatting below. It's take on it ain't pretty.
     # fmt: off
@@ -75,7 +83,7 @@ def build_thin_from_dataset(dataset: str, thin: str):
     )
     with jsonl.open(dataset, gzip=True) as dataset_fh:
         with jsonl.open(thin, gzip=True) as thin_fh:
-            for doc in tqdm(dataset_fh):
+            for doc in tqdm(dataset_fh.readlines(keys=desired_cols)):
                 thin_entry = {col: doc[col] for col in desired_cols}
                 thin_fh.appendline(thin_entry)
 
@@ -120,6 +128,43 @@ def filter_urls(urls_file: str, out: str, prop_name: str = "original"):
                     output_fh.appendline(snapshot_entry)
 
 
+def dedup_urls(
+    urls_file: str,
+    out: str,
+    max_length: int = MAX_LENGTH,
+    prop_name: str = "original",
+):
+    """
+    Drop snapshots that need not be downloaded: byte-identical copies of an earlier
+    snapshot (same CDX digest), other variants of an earlier URL (same URL after
+    Article.normalize_url) and snapshots over max_length bytes. The first snapshot
+    of each page is kept.
+    """
+    digests = set()
+    urls = set()
+    dropped = Counter()
+
+    with jsonl.open(urls_file, gzip=True) as urls_file_fh:
+        with jsonl.open(out, gzip=True) as output_fh:
+            for snapshot_entry in tqdm(urls_file_fh):
+                digest = snapshot_entry.get("digest")
+                url = Article.normalize_url(snapshot_entry[prop_name])
+                length = snapshot_entry.get("length", "-")
+
+                if digest and digest in digests:
+                    dropped["same digest"] += 1
+                elif url in urls:
+                    dropped["same url"] += 1
+                elif max_length and str(length).isdigit() and int(length) > max_length:
+                    dropped["too large"] += 1
+                else:
+                    digests.add(digest)
+                    urls.add(url)
+                    output_fh.appendline(snapshot_entry)
+
+    print("kept %d snapshots, dropped %s" % (len(urls), dict(dropped)))
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -169,6 +214,21 @@ if __name__ == "__main__":
 
     filter_url_parser.set_defaults(func=cmdline_filter_urls)
 
+    # 4th parser
+    dedup_parser = subparsers.add_parser(
+        "dedup-urls", help="drop duplicate and oversized snapshots"
+    )
+
+    dedup_parser.add_argument("--urls-file", required=True)
+    dedup_parser.add_argument("--out", required=True)
+    dedup_parser.add_argument("--max-length", type=int, default=MAX_LENGTH)
+
+    def cmdline_dedup_urls(args: Namespace):
+        """Small wrapper to keep things clean"""
+        dedup_urls(args.urls_file, args.out, args.max_length)
+
+    dedup_parser.set_defaults(func=cmdline_dedup_urls)
+
     # ====== #
 
     args = parser.parse_args()
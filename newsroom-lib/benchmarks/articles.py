@@ -0,0 +1,231 @@
+################################################################################
+
+# Compares Article's single lxml parse per page with the previous pipeline
+# (Readability parsing the page itself, a full-page BeautifulSoup for the
+# meta tags and canonical link, and a second BeautifulSoup for the
+# paragraphs of Readability's output) on a sample of archived pages.
+# Every page must serialize to the same output both ways.
+#
+#     python benchmarks/articles.py --archive dev.archive --pages 1000
+
+import click
+import random
+import time
+
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from readability import Document
+
+from newsroom import jsonl
+from newsroom.build import Article
+from newsroom.build.download import decode_html
+from newsroom.build.filter import _whitespace
+
+################################################################################
+
+class _Previous(Article):
+
+    # Article as it was before sharing one lxml tree.
+
+    def _parse_html(self):
+
+        self._load_html()
+        self._find_canonical_url()
+
+        self._extract_text()
+        self._extract_summary()
+
+
+    def _load_html(self):
+
+        if self.html.strip() == "":
+
+            raise ValueError("No page content?")
+
+        self.readability = Document(self.html)
+        self.soup = BeautifulSoup(self.html, "lxml")
+
+
+    def _find_canonical_url(self):
+
+        self.original_url = self.url
+
+        try:
+
+            rel_canon = self.soup.find("link", {"rel": "canonical"}).get("href")
+            norm_canon_url = self.normalize_url(urljoin(self.url, rel_canon))
+
+            if self.same_domain(self.url, norm_canon_url):
+
+                self.url = self.norm_canon_url
+
+        except Exception:
+
+            pass
+
+
+    def _extract_summary(self):
+
+        self.all_summaries = {}
+
+        for meta in self.soup.findAll("meta"):
+            for attr, value in meta.attrs.items():
+
+                if attr in ("name", "property") and "description" in value:
+
+                    try:
+
+                        self.all_summaries[value] = meta.get("content").strip()
+
+                    except Exception:
+
+                        continue
+
+        if len(self.all_summaries) == 0:
+
+            self.summary = None
+            return
+
+        for kind in ("og:description", "twitter:description", "description"):
+
+            if kind in self.all_summaries:
+
+                self.summary = self.all_summaries[kind]
+                break
+
+        else:
+
+            self.summary = self.all_summaries[sorted(self.all_summaries)[0]]
+
+
+    def _extract_text(self):
+
+        body_soup = BeautifulSoup(self.readability.summary(), "lxml")
+
+        paragraph_text = []
+
+        for paragraph in body_soup.findAll("p"):
+
+            if len(paragraph.text.split()) >= 5:
+
+                paragraph_text.append(
+                    _whitespace.sub(" ", paragraph.text).strip())
+
+        self.text = "\n\n".join(paragraph_text)
+        self.title = self.readability.short_title()
+
+
+def _serialize(kind, url, html):
+
+    try:
+
+        return kind(url, html, parse_archive = False).serialize()
+
+    except Exception:
+
+        return None
+
+
+def _sample(archive, pages, seed, codec):
+
+    # Reservoir sample of archive entries, as (url, decoded html) pairs.
+
+    rng = random.Random(seed)
+    reservoir = []
+
+    with jsonl.open(archive, **codec) as f:
+
+        for seen, entry in enumerate(f.readlines(ignore_errors = True)):
+
+            if len(reservoir) < pages:
+
+                reservoir.append(entry)
+
+            else:
+
+                r = rng.randint(0, seen)
+
+                if r < pages:
+
+                    reservoir[r] = entry
+
+    return [(page.get("archive", page.get("url")), decode_html(page))
+            for page in reservoir]
+
+
+def _timed(kind, sample):
+
+    start = time.perf_counter()
+    results = [_serialize(kind, url, html) for url, html in sample]
+
+    return time.perf_counter() - start, results
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--archive",
+    type = click.Path(exists = True, dir_okay = False),
+    required = True,
+    help = "Archive of raw article HTML to sample.",
+)
+
+@click.option(
+    "--pages",
+    type = int,
+    default = 1000,
+    help = "Number of pages to sample. [default = 1000]",
+)
+
+@click.option(
+    "--zstd",
+    is_flag = True,
+    help = "The archive is compressed with zstd. [default = off]",
+)
+
+@click.option(
+    "--seed",
+    type = int,
+    default = 0,
+    help = "Random seed for sampling. [default = 0]",
+)
+
+################################################################################
+
+def main(archive, pages, zstd, seed):
+
+    codec = {"zstd": True} if zstd else {"gzip": True}
+    sample = _sample(archive, pages, seed, codec)
+
+    before, expected = _timed(_Previous, sample)
+    after, results = _timed(Article, sample)
+
+    different = [url for (url, _), a, b in zip(sample, expected, results)
+                 if a != b]
+
+    print("{:9} {:7.2f}s {:8.1f} pages/s".format(
+        "previous", before, len(sample) / before))
+    print("{:9} {:7.2f}s {:8.1f} pages/s".format(
+        "single", after, len(sample) / after))
+    print()
+
+    if different:
+
+        print(len(different), "of", len(sample), "pages serialize differently:")
+
+        for url in different:
+
+            print("-", url)
+
+    else:
+
+        print("All", len(sample), "pages serialize the same.")
+
+
+if __name__ == "__main__":
+
+    main()
+
+################################################################################
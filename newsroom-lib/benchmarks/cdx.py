@@ -0,0 +1,104 @@
+################################################################################
+
+# Time newsroom-cdx against the CDX stand-in of the mock Wayback server,
+# downloading one page at a time (like the old CdxSpider's page count
+# request followed by throttled pages) and with several workers.
+# --latency stands in for the time the CDX server takes per page.
+#
+#     python benchmarks/cdx.py --snapshots 20000 --latency 0.5
+
+import click
+import os
+import tempfile
+import time
+
+from server import Wayback
+
+from newsroom import jsonl
+from newsroom.build import cdx
+
+################################################################################
+
+def _run(server, workers, directory):
+
+    output = os.path.join(directory, "{}.jsonl.gz".format(workers))
+    root = "http://127.0.0.1:{}/cdx/search/cdx".format(server.server_address[1])
+
+    start = time.perf_counter()
+
+    cdx.main.main([
+        "--domain",  "example.dk",
+        "--output",  output,
+        "--server",  root,
+        "--workers", str(workers),
+        "--sleep",   "0",
+    ], standalone_mode = False)
+
+    seconds = time.perf_counter() - start
+
+    with jsonl.open(output, gzip = True) as f:
+
+        rows = sum(1 for _ in f)
+
+    return seconds, rows
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--snapshots",
+    type = int,
+    default = 20000,
+    help = "Snapshots in the CDX index. [default = 20000]",
+)
+
+@click.option(
+    "--page-size",
+    type = int,
+    default = 100,
+    help = "Rows per CDX page. [default = 100]",
+)
+
+@click.option(
+    "--workers",
+    type = int,
+    default = 8,
+    help = "Concurrent page downloads. [default = 8]",
+)
+
+@click.option(
+    "--latency",
+    type = float,
+    default = 0.5,
+    help = "Server delay per page. [default = 0.5 sec]",
+)
+
+################################################################################
+
+def main(snapshots, page_size, workers, latency):
+
+    results = []
+
+    with Wayback(latency = latency, snapshots = snapshots,
+                 page_size = page_size) as server:
+
+        with tempfile.TemporaryDirectory() as directory:
+
+            for count in (1, workers):
+
+                results.append((count, _run(server, count, directory)))
+
+    print()
+
+    for count, (seconds, rows) in results:
+
+        print("{:2} workers {:7.2f}s {:8.1f} rows/s ({} rows)".format(
+            count, seconds, rows / seconds, rows))
+
+
+if __name__ == "__main__":
+
+    main()
+
+################################################################################
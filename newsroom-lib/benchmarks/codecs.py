@@ -0,0 +1,149 @@
+################################################################################
+
+# Compares reading and writing compressed jsonl files through the previous
+# fast path (os.popen("zcat < path"), a text pipe), the current fast path
+# (subprocess binary pipes, preferring pigz, pbzip2, xz -T0 and zstd -T0)
+# and the Python codecs.
+#
+#     python benchmarks/codecs.py --entries 20000
+
+import click
+import os
+import random
+import shlex
+import string
+import tempfile
+import time
+import ujson
+
+from newsroom import jsonl
+
+################################################################################
+
+_codecs = {
+    "gzip": "zcat",
+    "bzip": "bzcat",
+    "xz":   "xzcat",
+    "zstd": "zstd -dcq",
+}
+
+
+def _entries(count, size, seed):
+
+    # Records shaped like archive entries, with a large html value.
+
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k = rng.randint(2, 9)))
+             for _ in range(2000)]
+
+    for i in range(count):
+
+        html = " ".join(rng.choices(words, k = size // 6))
+
+        yield {
+            "archive": "http://web.archive.org/web/2019id_/http://example.dk/" + str(i),
+            "html":    "<html><body><p>" + html + "</p></body></html>",
+        }
+
+
+def _timed(function):
+
+    start = time.perf_counter()
+    result = function()
+
+    return time.perf_counter() - start, result
+
+
+def _popen(path, tool):
+
+    # The previous fast path.
+
+    with os.popen(tool + " < " + shlex.quote(path)) as f:
+
+        return sum(1 for line in f if ujson.loads(line))
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--entries",
+    type = int,
+    default = 20000,
+    help = "Number of records to write. [default = 20000]",
+)
+
+@click.option(
+    "--size",
+    type = int,
+    default = 20000,
+    help = "Approximate bytes of html per record. [default = 20000]",
+)
+
+@click.option(
+    "--codec",
+    type = click.Choice(sorted(_codecs)),
+    multiple = True,
+    help = "Codecs to compare. [default = all]",
+)
+
+@click.option(
+    "--level",
+    type = int,
+    default = 6,
+    help = "Compression level. [default = 6]",
+)
+
+################################################################################
+
+def main(entries, size, codec, level):
+
+    records = list(_entries(entries, size, 0))
+
+    print("Tools:", ", ".join(t for t, has in sorted(jsonl._has.items()) if has))
+    print()
+    print("{:6} {:>12} {:>12} {:>12} {:>12} {:>12}".format(
+        "codec", "write py", "write fast", "read popen", "read py", "read fast"))
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        for name in codec or sorted(_codecs):
+
+            path = os.path.join(directory, "bench." + name)
+            kwargs = {name: True, "level": level}
+
+            row = []
+
+            for fast in (False, True):
+
+                with jsonl.open(path, fast = fast, **kwargs) as f:
+
+                    f.delete()
+                    seconds, _ = _timed(lambda: f.append(records) or f.close())
+
+                row.append(seconds)
+
+            seconds, count = _timed(lambda: _popen(path, _codecs[name]))
+            row.append(seconds)
+
+            assert count == entries
+
+            for fast in (False, True):
+
+                with jsonl.open(path, fast = fast, **kwargs) as f:
+
+                    seconds, count = _timed(lambda: sum(1 for _ in f))
+
+                row.append(seconds)
+
+                assert count == entries
+
+            print("{:6} {:>11.2f}s {:>11.2f}s {:>11.2f}s {:>11.2f}s {:>11.2f}s".format(
+                name, *row))
+
+
+if __name__ == "__main__":
+
+    main()
+
+################################################################################
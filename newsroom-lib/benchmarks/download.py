@@ -0,0 +1,101 @@
+################################################################################
+
+# Compares Downloader's pooled keep-alive session with a bare requests.get
+# per download (the previous behaviour) against a local mock Wayback server.
+# --handshake adds a delay to every new connection, standing in for the TCP
+# and TLS handshakes with web.archive.org.
+#
+#     python benchmarks/download.py --urls 500 --handshake 0.02
+
+import click
+import requests
+import time
+
+from server import Wayback
+
+from newsroom.build import Downloader
+
+################################################################################
+
+class _Unpooled(Downloader):
+
+    # Opens a new connection for every download.
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self.session = requests
+
+
+    def close(self):
+
+        pass
+
+
+def _run(downloader, urls):
+
+    start = time.perf_counter()
+    pages = sum(1 for page in downloader.download(urls) if page is not None)
+
+    return time.perf_counter() - start, pages
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--urls",
+    type = int,
+    default = 500,
+    help = "Number of pages to download. [default = 500]",
+)
+
+@click.option(
+    "--workers",
+    type = int,
+    default = 16,
+    help = "Downloader threads. [default = 16]",
+)
+
+@click.option(
+    "--latency",
+    type = float,
+    default = 0.005,
+    help = "Server delay per request. [default = 0.005 sec]",
+)
+
+@click.option(
+    "--handshake",
+    type = float,
+    default = 0.02,
+    help = "Server delay per new connection. [default = 0.02 sec]",
+)
+
+################################################################################
+
+def main(urls, workers, latency, handshake):
+
+    with Wayback(latency = latency, handshake = handshake) as server:
+
+        todo = server.urls(urls)
+
+        for name, kind in (("requests.get", _Unpooled), ("session", Downloader)):
+
+            downloader = kind(workers = workers, sleep = 0)
+            seconds, pages = _run(downloader, todo)
+
+            print("{:12} {:6.2f}s {:7.1f} ms/page ({} pages)".format(
+                name, seconds, 1000 * seconds * workers / max(1, pages), pages))
+
+            if kind is Downloader:
+
+                print("{:12} {}".format("", downloader.stats()))
+
+            downloader.close()
+
+
+if __name__ == "__main__":
+
+    main()
+
+################################################################################
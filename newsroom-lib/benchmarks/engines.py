@@ -0,0 +1,83 @@
+################################################################################
+
+# Throughput of the thread-based Downloader and the asyncio AsyncDownloader
+# against a local mock Wayback server. --latency stands in for the time
+# web.archive.org takes to answer, which is what bounds a thread pool.
+#
+#     python benchmarks/engines.py --urls 2000 --latency 0.2
+
+import click
+import time
+
+from server import Wayback
+
+from newsroom.build import Downloader, AsyncDownloader
+
+################################################################################
+
+def _run(downloader, urls):
+
+    start = time.perf_counter()
+    pages = sum(1 for page in downloader.download(urls) if page is not None)
+
+    return time.perf_counter() - start, pages
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--urls",
+    type = int,
+    default = 2000,
+    help = "Number of pages to download. [default = 2000]",
+)
+
+@click.option(
+    "--workers",
+    type = int,
+    default = 16,
+    help = "Downloader threads. [default = 16]",
+)
+
+@click.option(
+    "--concurrency",
+    type = int,
+    default = 200,
+    help = "AsyncDownloader requests in flight. [default = 200]",
+)
+
+@click.option(
+    "--latency",
+    type = float,
+    default = 0.2,
+    help = "Server delay per request. [default = 0.2 sec]",
+)
+
+################################################################################
+
+def main(urls, workers, concurrency, latency):
+
+    with Wayback(latency = latency) as server:
+
+        todo = server.urls(urls)
+
+        engines = (
+            ("threads", Downloader(workers = workers, sleep = 0)),
+            ("async", AsyncDownloader(concurrency = concurrency, sleep = 0)),
+        )
+
+        for name, downloader in engines:
+
+            seconds, pages = _run(downloader, todo)
+            downloader.close()
+
+            print("{:8} {:6.2f}s {:8.1f} pages/s ({} pages)".format(
+                name, seconds, pages / seconds, pages))
+
+
+if __name__ == "__main__":
+
+    main()
+
+################################################################################
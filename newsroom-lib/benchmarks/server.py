@@ -0,0 +1,213 @@
+################################################################################
+
+# Local stand-in for the Wayback Machine used by the download benchmarks.
+# Every /web/<timestamp>id_/<url> path returns a small article page. The
+# server speaks HTTP/1.1 keep-alive, and can add latency to every response
+# and to every new connection to mimic network round trips and handshakes,
+# and answer 429 with Retry-After once more than capacity requests arrive
+# within a second, like web.archive.org under load. It also answers CDX
+# queries (/cdx/search/cdx) with pages of JSON rows for a list of made-up
+# snapshots of example.dk, every fifth a byte-identical copy of the one
+# before (same digest).
+
+import hashlib
+import http.server
+import json
+import sys
+import threading
+import time
+
+from urllib.parse import parse_qs, urlparse
+
+################################################################################
+
+_page = (
+    "<html><head><title>{0}</title>"
+    "<meta name=\"description\" content=\"Resume af {0}\">"
+    "</head><body><article><p>{1}</p></article></body></html>"
+)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+
+        # Charged once per new TCP connection.
+
+        time.sleep(self.server.handshake)
+        super().setup()
+
+
+    def do_GET(self):
+
+        time.sleep(self.server.latency)
+
+        if not self.server.admit():
+
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path.startswith("/cdx/"):
+
+            self.send_body(self.server.cdx(self.path), "application/json")
+            return
+
+        if "id_/" not in self.path:
+
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = _page.format(self.path, "tekst " * self.server.words)
+        self.send_body(body, "text/html; charset=utf-8")
+
+
+    def send_body(self, body, kind):
+
+        body = body.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+
+        pass
+
+
+class Wayback(http.server.ThreadingHTTPServer):
+
+    """
+
+    Mock Wayback server on a free local port, run in a background thread.
+
+    Example:
+
+        >>> with Wayback(latency = 0.01) as server:
+        ...     urls = server.urls(100)
+
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency = 0.0, handshake = 0.0, words = 2000,
+                 capacity = None, snapshots = 0, page_size = 50):
+
+        super().__init__(("127.0.0.1", 0), _Handler)
+
+        self.latency   = latency
+        self.handshake = handshake
+        self.words     = words
+        self.capacity  = capacity
+        self.snapshots = snapshots
+        self.page_size = page_size
+
+        self.served    = 0
+        self.throttled = 0
+
+        self._lock   = threading.Lock()
+        self._second = 0
+        self._count  = 0
+
+
+    def admit(self):
+
+        # Count the request against the current second's capacity.
+
+        with self._lock:
+
+            second = int(time.monotonic())
+
+            if second != self._second:
+
+                self._second, self._count = second, 0
+
+            self._count += 1
+
+            if self.capacity is not None and self._count > self.capacity:
+
+                self.throttled += 1
+                return False
+
+            self.served += 1
+            return True
+
+
+    def handle_error(self, request, client_address):
+
+        # Clients hanging up (e.g. cancelled downloads) are expected.
+
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+
+            super().handle_error(request, client_address)
+
+
+    def cdx(self, path):
+
+        # Page count (showNumPages) or one page of rows with a header row.
+
+        query = parse_qs(urlparse(path).query)
+        pages = -(-self.snapshots // self.page_size)
+
+        if "showNumPages" in query:
+
+            return str(pages)
+
+        page = int(query.get("page", ["0"])[0])
+        start = page * self.page_size
+        stop = min(self.snapshots, start + self.page_size)
+
+        if start >= stop:
+
+            return ""
+
+        rows = [["urlkey", "timestamp", "original", "mimetype",
+                 "statuscode", "digest", "length"]]
+
+        for i in range(start, stop):
+
+            content = str(i - 1 if i % 5 == 4 else i).encode("utf-8")
+            digest = hashlib.sha1(content).hexdigest().upper()
+
+            rows.append([
+                "dk,example)/" + str(i),
+                "2019{:010d}".format(i),
+                "http://example.dk/" + str(i),
+                "text/html",
+                "200",
+                digest,
+                str(1000 + 37 * i % 50000),
+            ])
+
+        return json.dumps(rows)
+
+
+    def urls(self, count):
+
+        root = "http://127.0.0.1:{}/web/2019".format(self.server_address[1])
+        return [root + "id_/http://example.dk/{}".format(i) for i in range(count)]
+
+
+    def __enter__(self):
+
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+
+    def __exit__(self, *_):
+
+        self.shutdown()
+        self.server_close()
+
+################################################################################
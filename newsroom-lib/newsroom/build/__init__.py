@@ -1,3 +1,3 @@
-from .download import Downloader
+from .download import Downloader, AsyncDownloader, decode_html
 from .filter import Article
 from . import jsonl
@@ -0,0 +1,272 @@
+################################################################################
+
+import click
+import ujson
+
+from tqdm import tqdm
+from urllib.parse import urlencode
+
+from . import Downloader
+from .journal import Journal
+from newsroom import jsonl
+
+################################################################################
+
+# Snapshots of HTML pages that were archived successfully, one per URL.
+
+_params = [
+    ("collapse", "urlkey"),
+    ("output", "json"),
+    ("filter", "mimetype:text/html"),
+    ("filter", "statuscode:200"),
+    ("matchType", "domain"),
+]
+
+# Column names, used if a page does not start with a header row.
+
+_columns = [
+    "urlkey",
+    "timestamp",
+    "original",
+    "mimetype",
+    "statuscode",
+    "digest",
+    "length",
+]
+
+_snapshot = "https://web.archive.org/web/{}id_/{}"
+
+
+def _query(server, domain, page_size, **params):
+
+    query = _params + [("url", domain)]
+
+    if page_size:
+
+        query.append(("pageSize", page_size))
+
+    return server + "?" + urlencode(query + sorted(params.items()))
+
+
+def _rows(text):
+
+    # Snapshot entries of one page of JSON output, which starts with a
+    # header row naming the columns.
+
+    rows = ujson.loads(text) if text.strip() else []
+
+    if rows and rows[0][:1] == ["urlkey"]:
+
+        columns, rows = rows[0], rows[1:]
+
+    else:
+
+        columns = _columns
+
+    entries = []
+
+    for row in rows:
+
+        entry = dict(zip(columns, row))
+        entry["archive"] = _snapshot.format(entry["timestamp"], entry["original"])
+
+        entries.append(entry)
+
+    return entries
+
+################################################################################
+
+output_file = click.Path(
+    dir_okay     = False,
+    writable     = True,
+    resolve_path = True,
+)
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--domain",
+    type = str,
+    required = True,
+    help = "Domain to collect snapshots of, e.g. dr.dk.",
+)
+
+@click.option(
+    "--output",
+    type = output_file,
+    default = None,
+    help = "Output path of the snapshot list. [default = DOMAIN.jsonl.gz]",
+)
+
+@click.option(
+    "--server",
+    type = str,
+    default = "https://web.archive.org/cdx/search/cdx",
+    help = "CDX server endpoint. [default = web.archive.org]",
+)
+
+@click.option(
+    "--workers",
+    type = int,
+    default = 4,
+    help = "CDX pages downloaded at once. [default = 4]",
+)
+
+@click.option(
+    "--tries",
+    type = int,
+    default = 3,
+    help = "Download attempts per CDX page. [default = 3]",
+)
+
+@click.option(
+    "--sleep",
+    type = float,
+    default = 4,
+    help = "Delay between downloading pages, per worker. [default = 4 sec]",
+)
+
+@click.option(
+    "--timeout",
+    type = float,
+    default = 300,
+    help = "Seconds allowed for each CDX page. [default = 300]",
+)
+
+@click.option(
+    "--page-size",
+    type = int,
+    default = None,
+    help = "Index blocks per CDX page. [default = server default]",
+)
+
+@click.option(
+    "--user-agent",
+    type = str,
+    default = "NLP Research @ IT University of Copenhagen (djam@itu.dk)",
+    help = "User-Agent header; Archive.org refuses requests without one.",
+)
+
+################################################################################
+
+def main(domain, output, server, workers, tries, sleep, timeout, page_size,
+         user_agent):
+
+    """
+
+    Collect the snapshots of a domain from the Wayback CDX server into a
+    jsonl file ready for filtering and newsroom-scrape --thin. CDX pages
+    are downloaded concurrently and written by a single writer as they
+    arrive. Finished pages are logged in OUTPUT.pages once their rows are
+    on disk, so the command can be stopped at any time and run again to
+    resume.
+
+    """
+
+    if "/" in domain:
+
+        print("--domain should be a domain, without a path.")
+        return
+
+    output = output or domain + ".jsonl.gz"
+
+    scraper = Downloader(
+        workers = workers,
+        tries = tries,
+        sleep = sleep,
+        timeout = timeout,
+        html_only = False,
+    )
+
+    scraper.session.headers["User-Agent"] = user_agent
+
+    # The number of pages is only known to the server.
+
+    print("Counting CDX pages for", domain + ":", end = " ", flush = True)
+
+    try:
+
+        req = scraper.session.get(
+            _query(server, domain, page_size, showNumPages = "true"),
+            timeout = timeout)
+
+        req.raise_for_status()
+        pages = int(req.text)
+
+    except Exception as error:
+
+        print("failed.\nCouldn't retrieve the CDX page count:", error)
+        scraper.close()
+        return
+
+    journal = Journal(output + ".pages")
+
+    urls = [_query(server, domain, page_size, page = page)
+            for page in range(pages)]
+    todo = [url for url in urls if url not in journal]
+
+    print(pages, "pages,", pages - len(todo), "already collected.")
+
+    progress = tqdm(
+        total = pages,
+        initial = pages - len(todo),
+        desc = "Collecting Snapshots"
+    )
+
+    downloads = scraper.download(todo)
+
+    errors = rows = 0
+
+    try:
+
+        with jsonl.open(output, gzip = True, blocks = True) as f:
+
+            for page in downloads:
+
+                try:
+
+                    entries = _rows(page["html"]) if page else None
+
+                except (ValueError, KeyError, TypeError):
+
+                    entries = None
+
+                if entries is None:
+
+                    errors += 1
+
+                else:
+
+                    # Rows are on disk before the page counts as done.
+
+                    f.append(entries)
+                    f.flush()
+
+                    journal.record(page["url"], "ok", 200)
+                    rows += len(entries)
+
+                progress.set_postfix(rows = rows, refresh = False)
+                progress.update(1)
+
+        if errors > 0:
+
+            print("\n\n" + str(errors), "CDX pages failed. Run again to retry them.")
+
+        else:
+
+            print("\n\nCollected", rows, "snapshots into", output)
+
+    except KeyboardInterrupt:
+
+        print("\n\nCollection aborted with progress preserved.")
+        print("Run again to resume from this point.")
+
+    finally:
+
+        downloads.close()
+        scraper.close()
+        journal.close()
+
+################################################################################
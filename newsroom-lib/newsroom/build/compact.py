@@ -0,0 +1,221 @@
+################################################################################
+
+import click
+import os.path
+import random
+import re
+import requests
+
+from tqdm import tqdm
+
+from . import Article
+from newsroom import jsonl
+
+################################################################################
+
+# Scripts, styles and comments, none of which Article reads (Readability
+# drops scripts and styles before scoring, and text_content() skips
+# comments). Inline SVG stays: its <title> and <text> are page text.
+# Alternatives are tried at every position in turn, so a comment inside a
+# script (or a script inside a comment) goes with whatever encloses it.
+# Unclosed elements are left alone.
+
+_attributes = r"""(?:"[^"]*"|'[^']*'|[^'">])*"""
+
+_unread = re.compile(
+    r"<!--.*?-->"
+    r"|<(script|style)(?=[\s/>])" + _attributes + r">.*?</\1\s*>",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def compact_html(html):
+
+    """
+
+    Remove the <script> and <style> elements and comments from a page,
+    leaving every other byte (<meta>, <link>, <title>, inline <svg>, the
+    body) as it was. Works on text and on raw pages stored as latin-1 text
+    alike.
+
+    """
+
+    return _unread.sub("", html)
+
+
+def compact(page):
+
+    """
+
+    Compacted copy of a downloaded page (or archive entry). Raw pages
+    without a declared encoding get the encoding detected on the whole
+    page, so decode_html() decodes the compacted page the same way.
+
+    Example:
+
+        >>> page = compact({"archive": url, "html": html})
+        >>> Article.process(page) == Article.process(original)
+        True
+
+    """
+
+    page = dict(page)
+    html = page.get("html") or ""
+
+    if "encoding" in page and page["encoding"] is None:
+
+        detected = requests.compat.chardet.detect(html.encode("latin-1"))
+        page["encoding"] = detected["encoding"] or "utf-8"
+
+    page["html"] = compact_html(html)
+
+    return page
+
+
+def _verify(pairs):
+
+    # Extract the original and compacted pages, returning the URLs and
+    # fields that came out differently.
+
+    mismatches = []
+
+    for original, compacted in tqdm(pairs, desc = "Verifying"):
+
+        before = Article.process(original) or {}
+        after = Article.process(compacted) or {}
+
+        fields = [k for k in ("url", "title", "text", "summary")
+                  if before.get(k) != after.get(k)]
+
+        if fields:
+
+            mismatches.append((original.get("archive"), fields))
+
+    return mismatches
+
+################################################################################
+
+archive_file = click.Path(
+    exists       = True,
+    dir_okay     = False,
+    readable     = True,
+    resolve_path = True,
+)
+
+output_file = click.Path(
+    dir_okay     = False,
+    writable     = True,
+    resolve_path = True,
+)
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--archive",
+    type = archive_file,
+    required = True,
+    help = "Input path to archive of raw article HTML.",
+)
+
+@click.option(
+    "--output",
+    type = output_file,
+    required = True,
+    help = "Output path of the compacted archive.",
+)
+
+@click.option(
+    "--verify",
+    type = int,
+    default = 200,
+    help = "Pages to extract both ways and compare, 0 for none. [default = 200]",
+)
+
+@click.option(
+    "--zstd",
+    is_flag = True,
+    help = "Archives are compressed with zstd instead of gzip. [default = off]",
+)
+
+@click.option(
+    "--seed",
+    type = int,
+    default = 0,
+    help = "Random seed for sampling. [default = 0]",
+)
+
+################################################################################
+
+def main(archive, output, verify, zstd, seed):
+
+    """
+
+    Rewrite an archive without the scripts, styles and comments of its
+    pages, which newsroom-extract never reads. A random
+    sample of pages is then extracted from both versions, to check that
+    URLs, titles, text and summaries come out the same.
+
+    """
+
+    codec = {"zstd": True} if zstd else {"gzip": True, "blocks": True}
+
+    rng = random.Random(seed)
+    sample = []
+
+    with jsonl.open(archive, **codec) as source:
+        with jsonl.open(output, **codec) as target:
+
+            target.delete()
+
+            def compacted():
+
+                for seen, page in enumerate(source.readlines(ignore_errors = True)):
+
+                    result = compact(page)
+
+                    # Reservoir sample of (original, compacted) pairs.
+
+                    if len(sample) < verify:
+
+                        sample.append((page, result))
+
+                    else:
+
+                        r = rng.randint(0, seen)
+
+                        if r < verify:
+
+                            sample[r] = (page, result)
+
+                    yield result
+
+            target.append(tqdm(compacted(), desc = "Compacting"))
+
+    before = os.path.getsize(archive)
+    after = os.path.getsize(output)
+
+    print("\nSize:", before, "->", after, "bytes",
+          "({:.1f}%).".format(100 * after / max(1, before)))
+
+    if not sample:
+
+        return
+
+    mismatches = _verify(sample)
+
+    if mismatches:
+
+        print("\nVerification failed:", len(mismatches), "of", len(sample),
+              "pages extract differently. Keep using", archive)
+
+        for url, fields in mismatches:
+
+            print("-", url, "(" + ", ".join(fields) + ")")
+
+    else:
+
+        print("\nVerified:", len(sample), "pages extract the same.")
+
+################################################################################
@@ -0,0 +1,200 @@
+################################################################################
+
+import click
+import os.path
+import random
+import ujson
+
+from urllib.parse import urlparse
+
+from tqdm import tqdm
+
+from newsroom import jsonl
+
+try:
+
+    import zstandard
+
+except ImportError:
+
+    zstandard = None
+
+################################################################################
+
+def _domain(archive):
+
+    # Domain of the original page behind an Archive.org snapshot URL.
+
+    *_, url = archive.split("id_/")
+    return urlparse(url).netloc.split(":")[0]
+
+
+def _sample(lines, samples, domain, seed):
+
+    # Reservoir sample of encoded archive lines.
+
+    rng = random.Random(seed)
+    reservoir = []
+
+    for seen, entry in enumerate(lines):
+
+        if domain:
+
+            archive = entry.get("archive", entry.get("url", ""))
+            host = _domain(archive)
+
+            if host != domain and not host.endswith("." + domain):
+
+                continue
+
+        if len(reservoir) < samples:
+
+            reservoir.append(entry)
+
+        else:
+
+            r = rng.randint(0, seen)
+
+            if r < samples:
+
+                reservoir[r] = entry
+
+    return [ujson.dumps(entry).encode("utf-8") for entry in reservoir]
+
+################################################################################
+
+archive_file = click.Path(
+    exists       = True,
+    dir_okay     = False,
+    readable     = True,
+    resolve_path = True,
+)
+
+output_file = click.Path(
+    dir_okay     = False,
+    writable     = True,
+    resolve_path = True,
+)
+
+################################################################################
+
+@click.command()
+
+@click.option(
+    "--archive",
+    type = archive_file,
+    required = True,
+    help = "Input path to gzip archive (or dataset) to sample.",
+)
+
+@click.option(
+    "--output",
+    type = output_file,
+    required = True,
+    help = "Output path of the zstd file. The dictionary goes to OUTPUT.dict.",
+)
+
+@click.option(
+    "--samples",
+    type = int,
+    default = 5000,
+    help = "Number of records to train on. [default = 5000]",
+)
+
+@click.option(
+    "--size",
+    type = int,
+    default = 112640,
+    help = "Dictionary size in bytes. [default = 110 KB]",
+)
+
+@click.option(
+    "--level",
+    type = int,
+    default = 19,
+    help = "zstd compression level. [default = 19]",
+)
+
+@click.option(
+    "--domain",
+    type = str,
+    default = None,
+    help = "Only train on pages from this domain. [default = all]",
+)
+
+@click.option(
+    "--convert/--no-convert",
+    default = True,
+    help = "Recompress the archive into OUTPUT. [default = on]",
+)
+
+@click.option(
+    "--seed",
+    type = int,
+    default = 0,
+    help = "Random seed for sampling. [default = 0]",
+)
+
+################################################################################
+
+def main(archive, output, samples, size, level, domain, convert, seed):
+
+    """
+
+    Train a zstd dictionary on a sample of archive records and store it
+    next to OUTPUT, where jsonl.open(OUTPUT, zstd = True) will pick it up.
+    Unless --no-convert is given, the archive is then recompressed into
+    OUTPUT using the dictionary. To scrape straight into a zstd archive
+    with a dictionary, copy OUTPUT.dict to ARCHIVE.dict before running
+    newsroom-scrape --zstd.
+
+    """
+
+    if zstandard is None:
+
+        print("newsroom-dictionary requires zstandard (pip install zstandard).")
+        return
+
+    print("Sampling archive records:", end = " ", flush = True)
+
+    with jsonl.open(archive, gzip = True) as f:
+
+        sample = _sample(f.readlines(ignore_errors = True), samples, domain, seed)
+
+    print(len(sample), "records.")
+
+    if not sample:
+
+        print("Nothing to train on.")
+        return
+
+    print("Training", size, "byte dictionary...")
+
+    trained = zstandard.train_dictionary(
+        size, sample, level = level, threads = -1)
+
+    with open(output + ".dict", "wb") as f:
+
+        f.write(trained.as_bytes())
+
+    print("Wrote", output + ".dict")
+
+    if not convert:
+
+        return
+
+    with jsonl.open(archive, gzip = True) as source:
+        with jsonl.open(output, zstd = True, level = level) as target:
+
+            target.delete()
+
+            entries = source.readlines(ignore_errors = True)
+            target.append(tqdm(entries, desc = "Recompressing"))
+
+    before = os.path.getsize(archive)
+    after = os.path.getsize(output) + os.path.getsize(output + ".dict")
+
+    print("\nSize:", before, "->", after, "bytes",
+          "({:.1f}%).".format(100 * after / max(1, before)))
+
+################################################################################
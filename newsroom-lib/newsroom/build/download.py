@@ -1,5 +1,496 @@
-import time, random, requests
+import asyncio, collections, itertools, queue, time, requests, threading
 from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+from .journal import classify, retryable
+
+try:
+
+    import aiohttp
+
+except ImportError:
+
+    aiohttp = None
+
+
+class RateLimiter(object):
+
+    def __init__(
+
+            self,
+            rate = None,
+            burst = 1,
+            increase = 0.5,
+            decrease = 0.5,
+            minimum = 0.1,
+            maximum = None,
+
+            ):
+
+        """
+
+        Token bucket shared by all download workers, whose rate adapts
+        with AIMD: each success adds increase / rate, so the rate grows by
+        about increase requests per second every second, and a throttled
+        request or timeout multiplies it by decrease (at most once a
+        second, so one burst of failures counts once). A Retry-After
+        header holds back every worker until it has passed.
+
+        Arguments:
+
+            - rate: initial requests per second (default = None, unlimited)
+            - burst: requests allowed at once after idling (default = 1)
+            - increase: additive increase per second (default = 0.5)
+            - decrease: multiplicative decrease factor (default = 0.5)
+            - minimum: lowest rate (default = 0.1)
+            - maximum: highest rate (default = None, unbounded)
+
+        Example:
+
+            >>> limiter = RateLimiter(rate = 8)
+            >>> time.sleep(limiter.reserve())
+            >>> limiter.success()
+
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self._lock = threading.Lock()
+        self._next = 0.0
+        self._cut = 0.0
+
+
+    def reserve(self):
+
+        """
+
+        Take a token, returning the seconds to wait before using it.
+
+        """
+
+        if self.rate is None:
+
+            return 0.0
+
+        with self._lock:
+
+            now = time.monotonic()
+            slack = (self.burst - 1) / self.rate
+
+            # Next token time, never more than a burst in the past.
+
+            start = max(self._next, now - slack)
+            self._next = start + 1 / self.rate
+
+            return max(0.0, start - now)
+
+
+    def ready(self):
+
+        """
+
+        Seconds until a token is available, without taking it.
+
+        """
+
+        if self.rate is None:
+
+            return 0.0
+
+        with self._lock:
+
+            return max(0.0, self._next - time.monotonic())
+
+
+    def clone(self):
+
+        """
+
+        New limiter with the same settings and current rate.
+
+        """
+
+        return RateLimiter(
+            rate = self.rate,
+            burst = self.burst,
+            increase = self.increase,
+            decrease = self.decrease,
+            minimum = self.minimum,
+            maximum = self.maximum,
+        )
+
+
+    def success(self):
+
+        """
+
+        Raise the rate after a successful download.
+
+        """
+
+        if self.rate is None:
+
+            return
+
+        with self._lock:
+
+            self.rate += self.increase / self.rate
+
+            if self.maximum is not None:
+
+                self.rate = min(self.rate, self.maximum)
+
+
+    def failure(self, retry_after = None):
+
+        """
+
+        Cut the rate after a throttled request or timeout, and hold back
+        all requests for retry_after seconds if given.
+
+        """
+
+        if self.rate is None:
+
+            return
+
+        with self._lock:
+
+            now = time.monotonic()
+
+            if now >= self._cut:
+
+                self.rate = max(self.minimum, self.rate * self.decrease)
+                self._cut = now + 1
+
+            if retry_after:
+
+                self._next = max(self._next, now + retry_after)
+
+
+class _Host(object):
+
+    # Queue and health of a single host.
+
+    def __init__(self, limiter):
+
+        self.queue = collections.deque()
+        self.limiter = limiter
+        self.active = 0
+        self.failures = 0
+        self.until = 0.0
+        self.since = 0.0
+        self.sent = {}
+
+
+class Scheduler(object):
+
+    def __init__(
+
+            self,
+            urls,
+            limiter = None,
+            concurrency = None,
+            cooldown = 1,
+            maximum = 300,
+            backlog = 1000,
+
+            ):
+
+        """
+
+        Per-host queues for a stream of URLs, shared by download workers.
+        Each host gets its own copy of limiter, so a host that throttles
+        only slows down itself, and at most concurrency downloads in
+        flight. A host that fails (throttling, timeouts, connection
+        errors) rests for cooldown seconds, doubled for each failure in a
+        row up to maximum, while workers take URLs of other hosts. Only
+        downloads sent after the host's last rest began count, so a burst
+        of failures from downloads in flight together is one step. Ready
+        hosts take turns. Up to backlog URLs are read ahead from urls.
+
+        Arguments:
+
+            - urls: iterable of URLs to download
+            - limiter: RateLimiter copied for each host (default = None)
+            - concurrency: downloads in flight per host (default = None)
+            - cooldown: seconds a failing host rests (default = 1)
+            - maximum: longest rest of a failing host (default = 300)
+            - backlog: URLs read ahead into the queues (default = 1000)
+
+        Example:
+
+            >>> scheduler = Scheduler(urls, concurrency = 4)
+            >>> url, attempt = scheduler.next()
+            >>> scheduler.finish(url, "ok")
+
+        """
+
+        self.urls = iter(urls)
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.cooldown = cooldown
+        self.maximum = maximum
+        self.backlog = backlog
+
+        self.hosts = collections.OrderedDict()
+        self.queued = 0
+        self.active = 0
+        self.exhausted = False
+        self.closed = False
+
+        self._lock = threading.Condition()
+
+
+    @property
+    def done(self):
+
+        """
+
+        True once every URL has been read and finished.
+
+        """
+
+        return self.exhausted and self.queued == 0 and self.active == 0
+
+
+    def rate(self):
+
+        """
+
+        Sum of the current rates of all hosts seen, or None if unlimited.
+
+        """
+
+        if self.limiter.rate is None:
+
+            return None
+
+        with self._lock:
+
+            return sum(host.limiter.rate for host in self.hosts.values())
+
+
+    def poll(self):
+
+        """
+
+        Take a URL that can be downloaded now, without waiting.
+
+        Returns:
+
+            (url, attempt, 0) or, if no host is ready, (None, None, delay)
+            with the seconds until one might be (None to wait for finish)
+
+        """
+
+        with self._lock:
+
+            return self._poll()
+
+
+    def next(self):
+
+        """
+
+        Take a URL to download, waiting until a host is ready.
+
+        Returns:
+
+            (url, attempt), or (None, None) when done or closed
+
+        """
+
+        with self._lock:
+
+            while not self.closed:
+
+                url, attempt, delay = self._poll()
+
+                if url is not None:
+
+                    return url, attempt
+
+                if self.done:
+
+                    break
+
+                self._lock.wait(delay)
+
+        return None, None
+
+
+    def finish(self, url, outcome, retry_after = None, attempt = None):
+
+        """
+
+        Report how a download went, and queue it again if attempt is given.
+
+        Arguments:
+
+            - outcome: "ok" or an error class (see journal.backoff);
+                "throttled" and "timeout" slow the host down, and these
+                and "connection" make it rest
+            - retry_after: seconds the server asked to wait
+            - attempt: number of the next attempt, to retry the URL
+
+        """
+
+        with self._lock:
+
+            host = self.hosts[_hostname(url)]
+            host.active -= 1
+            self.active -= 1
+
+            # Downloads sent before the current rest began already
+            # counted with the failure that started it.
+
+            now = time.monotonic()
+            current = self._sent(host, url, now) >= host.since
+
+            if outcome == "ok":
+
+                host.limiter.success()
+
+                if current:
+
+                    host.failures = 0
+
+            elif outcome in ("throttled", "timeout", "connection"):
+
+                if outcome != "connection":
+
+                    host.limiter.failure(retry_after)
+
+                if current:
+
+                    host.failures += 1
+                    host.since = now
+
+                    rest = min(self.maximum, self.cooldown * 2 ** (host.failures - 1))
+                    host.until = max(host.until, now + rest)
+
+                if retry_after:
+
+                    host.until = max(host.until, now + retry_after)
+
+            if attempt is not None:
+
+                self._add(url, attempt)
+
+            self._lock.notify_all()
+
+
+    def close(self):
+
+        """
+
+        Stop handing out URLs.
+
+        """
+
+        with self._lock:
+
+            self.closed = True
+            self._lock.notify_all()
+
+
+    def _add(self, url, attempt = 0):
+
+        name = _hostname(url)
+        host = self.hosts.get(name)
+
+        if host is None:
+
+            host = self.hosts[name] = _Host(self.limiter.clone())
+
+        host.queue.append((url, attempt))
+        self.queued += 1
+
+
+    def _sent(self, host, url, now):
+
+        # When the earliest download of url in flight was handed out.
+
+        times = host.sent.get(url)
+
+        if not times:
+
+            return now
+
+        sent = times.popleft()
+
+        if not times:
+
+            del host.sent[url]
+
+        return sent
+
+
+    def _feed(self):
+
+        if self.exhausted or self.queued >= self.backlog:
+
+            return
+
+        wanted = self.backlog - self.queued
+        read = 0
+
+        for url in itertools.islice(self.urls, wanted):
+
+            self._add(url)
+            read += 1
+
+        self.exhausted = read < wanted
+
+
+    def _poll(self):
+
+        self._feed()
+
+        now = time.monotonic()
+        delay = None
+
+        for name, host in self.hosts.items():
+
+            if not host.queue:
+
+                continue
+
+            if self.concurrency and host.active >= self.concurrency:
+
+                continue
+
+            wait = max(host.until - now, host.limiter.ready())
+
+            if wait > 0:
+
+                delay = wait if delay is None else min(delay, wait)
+                continue
+
+            # Move the host to the back so the others get a turn.
+
+            host.limiter.reserve()
+            host.active += 1
+
+            self.active += 1
+            self.queued -= 1
+
+            self.hosts.move_to_end(name)
+
+            url, attempt = host.queue.popleft()
+            host.sent.setdefault(url, collections.deque()).append(now)
+
+            return url, attempt, 0
+
+        return None, None, delay
 
 
 class Downloader(object):
@@ -11,6 +502,15 @@ class Downloader(object):
             tries = 3,
             sleep = 2,
             multiplier = 1.5,
+            connections = None,
+            timeout = 60,
+            limiter = None,
+            per_host = None,
+            cooldown = 1,
+            journal = None,
+            max_size = None,
+            html_only = True,
+            raw = False,
 
             ):
 
@@ -24,13 +524,38 @@ class Downloader(object):
             - workers: the number of threads to launch (default = 8)
             - tries: download attempts to make after a failure (default = 3)
             - sleep: approx thread wait time between downloads (default = 2)
-                * (approximate rate is workers/sleep URLs per second)
-            - multiplier: increase sleep time on each try (default = 1.5)
+                * (the initial rate is workers/sleep URLs per second,
+                   unlimited if 0)
+            - multiplier: divide the rate by this when the server
+                throttles or times out (default = 1.5)
+            - connections: keep-alive connections kept open per host,
+                shared by all workers (default = workers); pools of up
+                to 1024 hosts are kept at once
+            - timeout: seconds allowed for each download (default = 60)
+            - limiter: RateLimiter copied for each host, replacing sleep
+                and multiplier (default = None)
+            - per_host: downloads in flight per host (default = None)
+            - cooldown: seconds a failing host rests, doubled for each
+                failure in a row (default = 1)
+            - journal: Journal to record the outcome of each URL in
+                (default = None)
+            - max_size: largest body to download in bytes; larger pages
+                are abandoned as "too_large" (default = None, unlimited)
+            - html_only: abandon pages whose Content-Type is not HTML as
+                "not_html" before reading them (default = True)
+            - raw: return the body undecoded (see decode_html) with the
+                encoding requests would have used, unless it decodes
+                cleanly in its declared charset (default = False)
+
+        URLs are spread over per-host queues by a Scheduler, so a host
+        that throttles or fails only slows down its own downloads.
 
         Example:
 
             >>> ts = Downloader(workers = 12)
             >>> results = ts.download(["youtube.com"])
+            >>> ts.stats()
+            {'requests': 1, 'connections': 1, 'hits': 0, 'misses': 1}
 
         """
 
@@ -38,48 +563,785 @@ class Downloader(object):
         self.tries = tries
         self.sleep = sleep
         self.multiplier = multiplier
+        self.connections = connections or workers
+        self.timeout = timeout
+        self.limiter = limiter or _limiter(workers, sleep, multiplier)
+        self.per_host = per_host
+        self.cooldown = cooldown
+        self.journal = journal
+        self.max_size = max_size
+        self.html_only = html_only
+        self.raw = raw
+        self.scheduler = None
 
+        # One session shared by all workers, so connections to the same
+        # host are reused instead of paying a TCP and TLS handshake for
+        # every download. Each host gets a pool of connections; workers
+        # wait for a free connection rather than opening extra ones.
 
-    def download(self, urls):
+        adapter = HTTPAdapter(
+            pool_connections = _HOSTS,
+            pool_maxsize = self.connections,
+            pool_block = True,
+        )
 
-        """
+        # Counters of host pools that were closed, either evicted for a
+        # new host or by close(), so stats() still includes them.
 
-        Download a thing.
+        self.closed = {"requests": 0, "connections": 0}
+        self.lock = threading.Lock()
 
-        """
+        pools   = adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def retire(pool):
 
-        urls = list(urls)
+            with self.lock:
 
-        with ThreadPoolExecutor(self.workers) as executor:
+                self.closed["requests"] += pool.num_requests
+                self.closed["connections"] += pool.num_connections
 
-            yield from executor.map(self._thread, urls)
+            # urllib3 1.x closes evicted pools, 2.x leaves them to the
+            # garbage collector.
 
+            if dispose is not None:
 
-    def _thread(self, url):
+                dispose(pool)
 
-        sleep = self.sleep
+        pools.dispose_func = retire
 
-        for _ in range(self.tries):
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-            time.sleep(random.random() * sleep * 2)
 
-            try:
+    def stats(self):
 
-                req = requests.get(url)
+        """
 
-                if req.status_code == 200:
+        Connection pool counters: requests sent, new connections opened
+        (misses) and requests that reused a kept-alive connection (hits).
+        Hosts whose pools were closed are included.
 
-                    return {
-                        "url": url,
-                        "html": req.text
-                    }
+        """
 
-                else:
+        with self.lock:
 
-                    raise Exception()
+            requests_sent = self.closed["requests"]
+            connections = self.closed["connections"]
 
-            except Exception:
+        for adapter in set(self.session.adapters.values()):
 
-                sleep *= self.multiplier
+            manager = adapter.poolmanager
 
-        return None
+            for key in manager.pools.keys():
+
+                pool = manager.pools.get(key)
+
+                if pool is not None:
+
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "hits": requests_sent - connections,
+            "misses": connections,
+        }
+
+
+    def rate(self):
+
+        """
+
+        Current total download rate allowed, or None if unlimited.
+
+        """
+
+        if self.scheduler is None:
+
+            return self.limiter.rate
+
+        return self.scheduler.rate()
+
+
+    def close(self):
+
+        """
+
+        Close all pooled connections.
+
+        """
+
+        self.session.close()
+
+
+    def download(self, urls):
+
+        """
+
+        Download URLs, yielding results (or None) in completion order,
+        so one slow page does not hold back the ones finished after it.
+        URLs are read lazily into the scheduler's per-host queues, and
+        failed downloads go back to the end of their host's queue until
+        they run out of tries. Closing the generator stops the workers
+        and leaves running downloads to finish in the background.
+
+        """
+
+        scheduler = self.scheduler = _schedule(self, urls)
+
+        results = queue.Queue(2 * self.workers)
+        executor = ThreadPoolExecutor(self.workers)
+
+        for _ in range(self.workers):
+
+            executor.submit(self._thread, scheduler, results)
+
+        try:
+
+            running = self.workers
+
+            while running:
+
+                result = results.get()
+
+                if result is _finished:
+
+                    running -= 1
+
+                else:
+
+                    yield result
+
+        finally:
+
+            scheduler.close()
+            executor.shutdown(wait = False)
+
+
+    def _thread(self, scheduler, results):
+
+        try:
+
+            while True:
+
+                url, attempt = scheduler.next()
+
+                if url is None:
+
+                    break
+
+                page, outcome, retry_after, status = self._get(url)
+                last = _last(page, outcome, attempt, self.tries)
+
+                scheduler.finish(
+                    url, outcome, retry_after, None if last else attempt + 1)
+
+                if last:
+
+                    if self.journal is not None:
+
+                        _record(self, url, outcome, status, attempt)
+
+                    _put(results, page, scheduler)
+
+        finally:
+
+            _put(results, _finished, scheduler)
+
+
+    def _get(self, url):
+
+        # One download attempt: (page or None, outcome, retry_after, status).
+
+        # The body is streamed, so oversized and non-HTML pages are
+        # abandoned without downloading all of them.
+
+        try:
+
+            with self.session.get(
+                    url, timeout = self.timeout, stream = True) as req:
+
+                if req.status_code != 200:
+
+                    return (None, classify(req.status_code),
+                            _retry_after(req.headers), req.status_code)
+
+                refused = _refused(req.headers, self.html_only, self.max_size)
+
+                if refused:
+
+                    return None, refused, None, 200
+
+                body = bytearray()
+
+                for chunk in req.iter_content(_chunk):
+
+                    body += chunk
+
+                    if _over(len(body), self.max_size):
+
+                        return None, "too_large", None, 200
+
+                page = _page(url, bytes(body), req.headers, self.raw)
+
+                return page, "ok", None, 200
+
+        except Exception as error:
+
+            return None, _failure(error), None, None
+
+
+class AsyncDownloader(object):
+
+    def __init__(
+
+            self,
+            concurrency = 200,
+            workers = 8,
+            tries = 3,
+            sleep = 2,
+            multiplier = 1.5,
+            connections = None,
+            timeout = 60,
+            limiter = None,
+            per_host = None,
+            cooldown = 1,
+            journal = None,
+            max_size = None,
+            html_only = True,
+            raw = False,
+
+            ):
+
+        """
+
+        Download a list of URLs on a single asyncio event loop, keeping up
+        to concurrency requests in flight. Takes the same retry and rate
+        limiting arguments as Downloader. Requires aiohttp.
+
+        Arguments:
+
+            - concurrency: requests in flight at once (default = 200)
+            - workers: threads of the Downloader whose initial rate to
+                match, which does not depend on concurrency (default = 8)
+            - tries: download attempts to make after a failure (default = 3)
+            - sleep: approx wait time before each download (default = 2)
+                * (the initial rate is workers/sleep URLs per second,
+                   unlimited if 0)
+            - multiplier: divide the rate by this when the server
+                throttles or times out (default = 1.5)
+            - connections: open connections per host (default = concurrency)
+            - timeout: seconds allowed for each download (default = 60)
+            - limiter: RateLimiter copied for each host, replacing sleep
+                and multiplier (default = None)
+            - per_host: downloads in flight per host (default = None)
+            - cooldown: seconds a failing host rests, doubled for each
+                failure in a row (default = 1)
+            - journal: Journal to record the outcome of each URL in
+                (default = None)
+            - max_size: largest body to download in bytes; larger pages
+                are abandoned as "too_large" (default = None, unlimited)
+            - html_only: abandon pages whose Content-Type is not HTML as
+                "not_html" before reading them (default = True)
+            - raw: return the body undecoded (see decode_html) with the
+                encoding requests would have used, unless it decodes
+                cleanly in its declared charset (default = False)
+
+        Example:
+
+            >>> ts = AsyncDownloader(concurrency = 500)
+            >>> results = ts.download(["youtube.com"])
+
+        """
+
+        if aiohttp is None:
+
+            raise ImportError(
+                "AsyncDownloader requires aiohttp (pip install aiohttp)")
+
+        self.concurrency = concurrency
+        self.workers = workers
+        self.tries = tries
+        self.sleep = sleep
+        self.multiplier = multiplier
+        self.connections = connections or concurrency
+        self.timeout = timeout
+        self.limiter = limiter or _limiter(workers, sleep, multiplier)
+        self.per_host = per_host
+        self.cooldown = cooldown
+        self.journal = journal
+        self.max_size = max_size
+        self.html_only = html_only
+        self.raw = raw
+        self.scheduler = None
+
+        self.counts = {"requests": 0, "connections": 0}
+
+
+    def stats(self):
+
+        """
+
+        Connection counters, as in Downloader.stats().
+
+        """
+
+        sent, opened = self.counts["requests"], self.counts["connections"]
+
+        return {
+            "requests": sent,
+            "connections": opened,
+            "hits": sent - opened,
+            "misses": opened,
+        }
+
+
+    def rate(self):
+
+        """
+
+        Current total download rate allowed, or None if unlimited.
+
+        """
+
+        if self.scheduler is None:
+
+            return self.limiter.rate
+
+        return self.scheduler.rate()
+
+
+    def close(self):
+
+        """
+
+        Connections are closed when download() finishes.
+
+        """
+
+
+    def download(self, urls):
+
+        """
+
+        Download URLs, yielding results (or None) in completion order.
+        URLs are read lazily into the scheduler's per-host queues, and the
+        event loop only runs while the caller waits for the next result.
+        Closing the generator cancels all downloads in flight.
+
+        """
+
+        loop = asyncio.new_event_loop()
+
+        try:
+
+            self.scheduler = _schedule(self, urls)
+
+            results, main = loop.run_until_complete(
+                self._start(self.scheduler))
+
+            while True:
+
+                result = loop.run_until_complete(results.get())
+
+                if result is _finished:
+
+                    break
+
+                yield result
+
+            loop.run_until_complete(main)
+
+        finally:
+
+            pending = asyncio.all_tasks(loop)
+
+            for task in pending:
+
+                task.cancel()
+
+            if pending:
+
+                loop.run_until_complete(asyncio.wait(pending))
+
+            loop.close()
+
+
+    async def _start(self, scheduler):
+
+        # The queue must be created inside the loop that uses it.
+
+        results = asyncio.Queue(self.concurrency)
+        main = asyncio.ensure_future(self._main(scheduler, results))
+
+        return results, main
+
+
+    async def _main(self, scheduler, results):
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._count("requests"))
+        trace.on_connection_create_end.append(self._count("connections"))
+
+        session = aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(
+                limit = self.concurrency,
+                limit_per_host = self.connections),
+            timeout = aiohttp.ClientTimeout(total = self.timeout),
+            trace_configs = [trace],
+        )
+
+        cancelled = False
+
+        try:
+
+            async with session:
+
+                ready = asyncio.Condition()
+
+                await asyncio.gather(*[
+                    self._worker(session, scheduler, results, ready)
+                    for _ in range(self.concurrency)
+                ])
+
+        except asyncio.CancelledError:
+
+            # The generator was closed, so nobody reads the queue any more
+            # and waiting for room in it would hang the shutdown.
+
+            cancelled = True
+            raise
+
+        finally:
+
+            if not cancelled:
+
+                await results.put(_finished)
+
+
+    def _count(self, name):
+
+        async def count(*_):
+
+            self.counts[name] += 1
+
+        return count
+
+
+    async def _worker(self, session, scheduler, results, ready):
+
+        # Workers wait on ready until a download finishes or a host's
+        # rest or rate limit is over.
+
+        while True:
+
+            url, attempt, delay = scheduler.poll()
+
+            if url is None:
+
+                if scheduler.done:
+
+                    break
+
+                async with ready:
+
+                    try:
+
+                        await asyncio.wait_for(ready.wait(), delay)
+
+                    except asyncio.TimeoutError:
+
+                        pass
+
+                continue
+
+            page, outcome, retry_after, status = await self._get(session, url)
+            last = _last(page, outcome, attempt, self.tries)
+
+            scheduler.finish(
+                url, outcome, retry_after, None if last else attempt + 1)
+
+            async with ready:
+
+                ready.notify_all()
+
+            if last:
+
+                if self.journal is not None:
+
+                    _record(self, url, outcome, status, attempt)
+
+                await results.put(page)
+
+
+    async def _get(self, session, url):
+
+        # One download attempt: (page or None, outcome, retry_after, status).
+
+        try:
+
+            async with session.get(url) as req:
+
+                if req.status != 200:
+
+                    return (None, classify(req.status),
+                            _retry_after(req.headers), req.status)
+
+                refused = _refused(req.headers, self.html_only, self.max_size)
+
+                if refused:
+
+                    return None, refused, None, 200
+
+                body = bytearray()
+
+                async for chunk in req.content.iter_chunked(_chunk):
+
+                    body += chunk
+
+                    if _over(len(body), self.max_size):
+
+                        return None, "too_large", None, 200
+
+                page = _page(url, bytes(body), req.headers, self.raw)
+
+                return page, "ok", None, 200
+
+        except asyncio.CancelledError:
+
+            raise
+
+        except Exception as error:
+
+            return None, _failure(error), None, None
+
+
+_finished = object()
+
+# Content types read by html_only downloaders, and the size of the chunks
+# bodies are streamed in.
+
+_html = ("text/html", "application/xhtml+xml")
+_chunk = 1 << 16
+
+# Host pools kept open by a Downloader; beyond this, the least recently
+# used host's connections are closed.
+
+_HOSTS = 1024
+
+
+def _last(page, outcome, attempt, tries):
+
+    # Whether this was the URL's last attempt in this run. Failures that
+    # will not go away (e.g. 404) are not retried.
+
+    return page is not None or attempt + 1 >= tries or not retryable(outcome)
+
+
+def _record(downloader, url, outcome, status, attempt):
+
+    # Journal the last attempt at url, with the size limit a page refused
+    # as too large exceeded, so a later run with a larger one retries it.
+
+    limit = downloader.max_size if outcome == "too_large" else None
+
+    downloader.journal.record(url, outcome, status, attempt + 1, limit = limit)
+
+
+def _failure(error):
+
+    # Error class of a download that raised instead of answering.
+
+    if isinstance(error, (requests.Timeout, asyncio.TimeoutError)):
+
+        return "timeout"
+
+    if isinstance(error, (requests.ConnectionError, ConnectionError)):
+
+        return "connection"
+
+    if aiohttp is not None and isinstance(error, aiohttp.ClientConnectionError):
+
+        return "connection"
+
+    return "error"
+
+
+def _hostname(url):
+
+    return urlparse(url).netloc.lower()
+
+
+def _schedule(downloader, urls):
+
+    return Scheduler(
+        urls,
+        limiter = downloader.limiter,
+        concurrency = downloader.per_host,
+        cooldown = downloader.cooldown,
+    )
+
+
+def _put(results, item, scheduler):
+
+    # Put on a bounded queue, giving up once the scheduler is closed.
+
+    while not scheduler.closed:
+
+        try:
+
+            results.put(item, timeout = 1)
+            return
+
+        except queue.Full:
+
+            pass
+
+
+def _limiter(workers, sleep, multiplier):
+
+    # Limiter matching the old per-thread sleep: workers/sleep requests
+    # per second to start with, divided by multiplier when throttled.
+
+    if not sleep:
+
+        return RateLimiter()
+
+    return RateLimiter(rate = workers / sleep, decrease = 1 / multiplier)
+
+
+def _retry_after(headers):
+
+    # Seconds to wait from a Retry-After header (delay or HTTP date).
+
+    value = headers.get("Retry-After")
+
+    if not value:
+
+        return None
+
+    try:
+
+        return max(0.0, float(value))
+
+    except ValueError:
+
+        pass
+
+    try:
+
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+
+    except (TypeError, ValueError):
+
+        return None
+
+
+def _refused(headers, html_only, max_size):
+
+    # Error class of a page that should not be read, judged by its
+    # headers alone, or None. Pages without a Content-Type are read.
+
+    kind = headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+    if html_only and kind and kind not in _html:
+
+        return "not_html"
+
+    try:
+
+        length = int(headers.get("Content-Length"))
+
+    except (TypeError, ValueError):
+
+        return None
+
+    return "too_large" if _over(length, max_size) else None
+
+
+def _over(size, max_size):
+
+    return max_size is not None and size > max_size
+
+
+def _page(url, body, headers, raw):
+
+    # Raw bodies that decode cleanly in their declared encoding are stored
+    # as text, exactly as requests would decode them. The rest are kept as
+    # latin-1 text, which maps every byte to one character, so they fit in
+    # JSON and decode_html() gets the bytes back. Non-ASCII characters then
+    # take a \u00XX escape per byte, so only pages that need detection (or
+    # do not match their charset) pay for that.
+
+    encoding = requests.utils.get_encoding_from_headers(headers)
+
+    if raw:
+
+        try:
+
+            return {
+                "url": url,
+                "html": str(body, encoding),
+            }
+
+        except (TypeError, LookupError, UnicodeDecodeError):
+
+            pass
+
+        return {
+            "url": url,
+            "html": body.decode("latin-1"),
+            "encoding": encoding,
+        }
+
+    return {
+        "url": url,
+        "html": _text(body, encoding),
+    }
+
+
+def decode_html(page):
+
+    """
+
+    HTML of a downloaded page (or archive entry) as text. Pages downloaded
+    with raw = True and kept undecoded are decoded now, with the encoding
+    stored next to them or else one detected from the body, exactly as
+    requests would have decoded them when downloading. Other pages are
+    already text.
+
+    Example:
+
+        >>> for page in Downloader(raw = True).download(urls):
+        ...     html = decode_html(page)
+
+    """
+
+    html = page.get("html") or ""
+
+    if "encoding" not in page:
+
+        return html
+
+    return _text(html.encode("latin-1"), page["encoding"])
+
+
+def _text(body, encoding = None):
+
+    # Decode a body the way requests' Response.text does, so both
+    # downloaders and both archive formats give the same HTML.
+
+    if encoding is None:
+
+        encoding = requests.compat.chardet.detect(body)["encoding"]
+
+    try:
+
+        return str(body, encoding or "utf-8", errors = "replace")
+
+    except LookupError:
+
+        return str(body, "utf-8", errors = "replace")
@@ -2,9 +2,10 @@
 
 from tqdm import tqdm
 
-import click, os
+import click, collections, os
+from functools import partial
 from multiprocessing import cpu_count
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 from . import Article
 
@@ -49,6 +50,130 @@ def binner(value, cutoffs, levels):
 
     return levels[-1]
 
+
+def measure(result, lang):
+
+    """
+
+    Add the extractive fragment measures (coverage, density, compression)
+    of an extracted article, and their bins. Articles without a summary or
+    text are left as they are.
+
+    """
+
+    if (result["text"] is None) or (result["summary"] is None):
+        return result
+
+    # this compared to the original impl.
+    # should skip empty summaries or bodies
+    # if not result["text"] or not result["summary"]:
+    #     return result
+
+    fragments = Fragments(result["summary"], result["text"], lang=lang)
+
+    result["density"] = fragments.density()
+    result["coverage"] = fragments.coverage()
+    result["compression"] = fragments.compression()
+
+    for name in ("compression", "coverage", "density"):
+
+        result[name + "_bin"] = binner(
+            result[name],
+            cutoffs[name],
+            levels[name])
+
+    return result
+
+
+def extract(page, lang, head_only = False):
+
+    """
+
+    Extract and measure a single archive entry. This is the whole job of
+    a worker process, so the parent only has to write the results.
+
+    Returns:
+
+        the dataset entry, or None if the page could not be extracted
+
+    """
+
+    result = Article.process(page, head_only = head_only)
+
+    if result is None:
+        return None
+
+    return measure(result, lang)
+
+
+def _initialize(lang):
+
+    # Load the spaCy pipeline once per worker, before its first article.
+
+    Fragments._load_model(lang)
+
+
+def imap(executor, function, items, window, ordered = False):
+
+    """
+
+    Like executor.map, but reading items lazily, with at most window items
+    submitted and not yet yielded, and yielding results as they finish.
+    With ordered, results are yielded in the order of items: finished
+    results wait in their futures until all earlier ones are done, while
+    later items keep the workers busy. Closing the generator cancels the
+    items not yet started.
+
+    """
+
+    pending = collections.deque() if ordered else set()
+
+    try:
+
+        for item in items:
+
+            future = executor.submit(function, item)
+
+            if ordered:
+
+                pending.append(future)
+
+                if len(pending) >= window:
+
+                    yield pending.popleft().result()
+
+            else:
+
+                pending.add(future)
+
+                if len(pending) >= window:
+
+                    done, pending = wait(pending, return_when = FIRST_COMPLETED)
+
+                    for future in done:
+
+                        yield future.result()
+
+        while pending:
+
+            if ordered:
+
+                yield pending.popleft().result()
+
+            else:
+
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+
+                for future in done:
+
+                    yield future.result()
+
+    finally:
+
+        for future in pending:
+
+            future.cancel()
+
 ################################################################################
 
 @click.command()
@@ -85,7 +210,13 @@ def binner(value, cutoffs, levels):
     "--chunksize",
     type = int,
     default = cpu_count() * 20,
-    help = "Items processed between updates. [default = 20*CPUs]",
+    help = "Articles queued for the workers at once. [default = 20*CPUs]",
+)
+
+@click.option(
+    "--ordered",
+    is_flag = True,
+    help = "Write articles in archive order. [default = as they finish]",
 )
 
 @click.option(
@@ -93,9 +224,24 @@ def binner(value, cutoffs, levels):
     required=True
 )
 
+@click.option(
+    "--head-only",
+    is_flag = True,
+    help = "Skip pages without a description in <head>. [default = off]",
+)
+
+@click.option(
+    "--zstd",
+    is_flag = True,
+    help = "Archive is compressed with zstd instead of gzip. [default = off]",
+)
+
 ################################################################################
 
-def main(archive, urldiff, dataset, workers, chunksize, lang):
+def main(archive, urldiff, dataset, workers, chunksize, ordered, lang,
+         head_only, zstd):
+
+    codec = {"zstd": True} if zstd else {"gzip": True, "workers": workers}
 
     if archive is None and urldiff is None:
 
@@ -116,12 +262,11 @@ def main(archive, urldiff, dataset, workers, chunksize, lang):
             for line in urls_file:
                 required.add(line.strip())
 
-        with jsonl.open(dataset, gzip = True) as dataset_file:
+        # URLs are looked up in the dataset's key table (DATASET.keys).
 
-            for article in dataset_file.readlines(ignore_errors = True):
+        with jsonl.open(dataset, gzip = True, key = "archive") as dataset_file:
 
-                url = article.get("archive", article.get("url"))
-                required.discard(url)
+            required = {url for url in required if url not in dataset_file}
 
         if len(required) > 0:
 
@@ -137,92 +282,80 @@ def main(archive, urldiff, dataset, workers, chunksize, lang):
 
         return
 
-    previously = set()
-    todo = set()
-
-    if os.path.isfile(dataset):
-
-        print("Comparing archive and dataset files: ", end = "")
-
-        with jsonl.open(dataset, gzip = True) as dataset_file:
-
-            for article in dataset_file.readlines(ignore_errors = True):
-
-                url = article.get("archive", article.get("url"))
-                previously.add(url)
+    # With --head-only, pages without a summary in their <head> are skipped
+    # before their body text is extracted.
 
-        print("found", len(previously), "finished summaries... ", end = "")
+    process = partial(extract, lang = lang, head_only = head_only)
 
-    else:
+    # A single pass over the archive: finished summaries come from the
+    # dataset's key table, and every URL is remembered as it streams by, so
+    # repeated and previously extracted ones are skipped without a scan of
+    # the archive up front. Progress is measured in archive bytes read.
 
-        print("Loading downloaded summaries: ", end = "")
+    with jsonl.open(archive, **codec) as archive_file:
+        with jsonl.open(
+                dataset, gzip = True, index = True, blocks = True,
+                key = "archive") as dataset_file:
 
-    with jsonl.open(archive, gzip = True) as archive_file:
+            seen = set(dataset_file.keys())
 
-        for article in archive_file.readlines(ignore_errors = True):
+            print("Found", len(seen), "finished summaries.\n")
 
-            url = article.get("archive", article.get("url"))
-            todo.add(url)
+            progress = tqdm(
+                total = os.path.getsize(archive),
+                unit = "B",
+                unit_scale = True,
+                desc = "Extracting Summaries",
+            )
 
-    todo -= previously
+            def articles():
 
-    print("found", len(todo), "new summaries.\n")
+                batches = archive_file.iter_batches(
+                    chunksize, ignore_errors = True)
 
-    with tqdm(total = len(todo), desc = "Extracting Summaries") as progress:
-        with jsonl.open(archive, gzip = True) as archive_file:
-            with jsonl.open(dataset, gzip = True) as dataset_file:
+                for batch in batches:
 
-                chunk = []
+                    progress.update(archive_file.tell() - progress.n)
 
-                def process_chunk():
+                    for article in batch:
 
-                    with ProcessPoolExecutor(workers) as ex:
-                        results = list(ex.map(Article.process, chunk))
-                        results = [r for r in results if r is not None]
+                        url = article.get("archive", article.get("url"))
+                        if url in seen: continue
 
-                        # Compute statistics.
+                        seen.add(url)
 
-                        for result in results:
-                            if (result["text"] is None) or (result["summary"] is None):
-                                continue
-                            # this compared to the original impl.
-                            # should skip empty summaries or bodies
-                            # if not result["text"] or not result["summary"]:
-                            #     continue
+                        yield article
 
-                            fragments = Fragments(result["summary"], result["text"], lang=lang)
+                progress.update(archive_file.tell() - progress.n)
 
-                            result["density"] = fragments.density()
-                            result["coverage"] = fragments.coverage()
-                            result["compression"] = fragments.compression()
+            # One pool of workers for the whole run, fed from a bounded
+            # window of articles, so every core stays busy and results are
+            # written as soon as they are done.
 
-                            result["compression"] = fragments.compression()
-                            result["coverage"] = fragments.coverage()
-                            result["density"] = fragments.density()
+            with progress, ProcessPoolExecutor(
+                    workers,
+                    initializer = _initialize,
+                    initargs = (lang,)) as ex:
 
-                            for measure in ("compression", "coverage", "density"):
+                results = imap(ex, process, articles(), chunksize, ordered)
+                written = 0
 
-                                result[measure + "_bin"] = binner(
-                                    result[measure],
-                                    cutoffs[measure],
-                                    levels[measure])
+                # Stop feeding the workers if interrupted.
 
-                        dataset_file.append(results)
-                        progress.update(len(results))
+                try:
 
-                for article in archive_file.readlines(ignore_errors = True):
+                    for result in results:
 
-                    url = article.get("archive", article.get("url"))
-                    if url not in todo: continue
+                        if result is not None:
 
-                    chunk.append(article)
+                            dataset_file.appendline(result)
+                            written += 1
 
-                    if len(chunk) >= chunksize:
+                        progress.set_postfix(articles = written, refresh = False)
 
-                        process_chunk()
-                        chunk = []
+                finally:
 
-                process_chunk()
+                    results.close()
 
     print("\nExtraction complete.")
 
@@ -1,12 +1,33 @@
+import lxml.html
 import re
 
+from lxml import etree
+
 from urllib.parse import quote, urlparse, urljoin
-from bs4 import BeautifulSoup
 from readability import Document
+from readability.htmls import build_doc
+
+from .download import decode_html
 
 
 _whitespace = re.compile(r"\s+")
 
+# Tags a parser leaves inside a <p>.
+
+_phrasing = frozenset([
+    "a", "abbr", "acronym", "b", "bdi", "bdo", "big", "br", "cite", "code",
+    "data", "del", "dfn", "em", "font", "i", "img", "ins", "kbd", "mark",
+    "q", "s", "samp", "small", "span", "strike", "strong", "sub", "sup",
+    "time", "tt", "u", "var", "wbr",
+])
+
+
+class _NoSummary(ValueError):
+
+    # A head_only page whose <head> has no usable description.
+
+    pass
+
 
 class Article(object):
 
@@ -17,12 +38,17 @@ class Article(object):
     that the provided URL in this case is actually the ARCHIVE url (Maybe this
     should be made clearer in the downloader script?).
 
+    With head_only, the summary and canonical URL are only looked for in the
+    page's <head>, which is parsed on its own first, and pages without a
+    usable summary there are given up before the full page is parsed.
+
     """
 
-    def __init__(self, archive, html, parse_archive):
+    def __init__(self, archive, html, parse_archive, head_only = False):
 
-        self.archive = archive
-        self.html    = html if html is not None else ""
+        self.archive   = archive
+        self.html      = html if html is not None else ""
+        self.head_only = head_only
 
         if parse_archive:
             self._parse_archive()
@@ -43,19 +69,42 @@ class Article(object):
 
     def _parse_html(self):
 
+        if self.head_only:
+
+            self.head_tags = self.head(self.html)
+            self._extract_summary()
+
+            if not self.summary:
+
+                raise _NoSummary("No summary in page head.")
+
         self._load_html()
         self._find_canonical_url()
 
+        # Readability drops hidden elements from the tree it is given, so
+        # the meta tags are read first.
+
+        if not self.head_only:
+
+            self._extract_summary()
+
         self._extract_text()
-        self._extract_summary()
 
 
     def _extract_summary(self):
 
         self.all_summaries = {}
 
-        for meta in self.soup.findAll("meta"):
-            for attr, value in meta.attrs.items():
+        if self.head_only:
+
+            metas = self.head_tags["meta"]
+
+        else:
+
+            metas = self.tree.iter("meta")
+
+        for meta in metas:
+            for attr, value in meta.attrib.items():
 
                 if attr in ("name", "property") and "description" in value:
 
@@ -99,23 +148,36 @@ class Article(object):
 
         # Confusingly, the Readability package calls the body text of the article
         # its "summary." We want to create a plain text document from the body text,
-        # so we need to extract the text from Readability's HTML version.
+        # so we need the text of Readability's HTML version. It keeps the tree it
+        # serialized, so we can read the paragraphs from that instead of parsing
+        # the HTML again. But Readability turns some <div>s into <p>s that hold
+        # headings, lists or other paragraphs, which a parser would split up, so
+        # those pages are still parsed again.
 
-        body_soup = BeautifulSoup(self.readability.summary(), "lxml")
+        summary = self.readability.summary()
+        body = self.readability.html
+
+        if any(child.tag not in _phrasing
+               for paragraph in body.iter("p")
+               for child in paragraph.iterdescendants()):
+
+            body = lxml.html.document_fromstring(summary)
 
 
         # Now go through and extract each paragraph (in order).
 
         paragraph_text = []
-        for paragraph in body_soup.findAll("p"):
+        for paragraph in body.iter("p"):
 
             # Very short pieces of text tend not to be article body text, but
             # captions, attributions, and advertising. It seems that excluding
             # paragraphs shorter than five words removes most of this.
 
-            if len(paragraph.text.split()) >= 5:
+            text = paragraph.text_content()
+
+            if len(text.split()) >= 5:
 
-                paragraph_body = _whitespace.sub(" ", paragraph.text).strip()
+                paragraph_body = _whitespace.sub(" ", text).strip()
                 paragraph_text.append(paragraph_body)
 
 
@@ -139,12 +201,13 @@ class Article(object):
 
             raise ValueError("No page content?")
 
-        # The document has content. Create:
-        # - A Readability parse object to extract the text
-        # - A full-page BeautifulSoup object to extract summaries.
+        # The document has content. Parse it once, the same way Readability
+        # would, into a single lxml tree shared by:
+        # - The summary and canonical URL lookups
+        # - A Readability object to extract the text
 
-        self.readability = Document(self.html)
-        self.soup = BeautifulSoup(self.html, "lxml")
+        self.tree, _ = build_doc(self.html)
+        self.readability = Document(self.tree)
 
 
     def _find_canonical_url(self):
@@ -157,10 +220,21 @@ class Article(object):
         try:
 
             # Try to extract the page's canonical URL, if it has one. If it doesn't,
-            # BeautifulSoup will raise an exception, and we will give up, sticking
+            # next() will raise an exception, and we will give up, sticking
             # with the normalized URL as the best URL.
 
-            rel_canon = self.soup.find("link", {"rel": "canonical"}).get("href")
+            if self.head_only:
+
+                links = self.head_tags["link"]
+
+            else:
+
+                links = self.tree.iter("link")
+
+            rel_canon = next(
+                link for link in links
+                if "canonical" in link.get("rel", "").split()
+            ).get("href")
 
 
             # I've sometimes seen the canonical URL be relative to the current page.
@@ -207,19 +281,64 @@ class Article(object):
 
 
     @staticmethod
-    def process(page):
+    def process(page, head_only = False):
 
         url = page.get("archive", page.get("url"))
-        html = page.get("html", "")
-        if html is None: html = ""
+        html = decode_html(page)
 
         try:
-            return Article(url, html, parse_archive=False).serialize()
+            return Article(url, html, parse_archive=False,
+                           head_only=head_only).serialize()
+        except _NoSummary:
+            return None
         except Exception as exception:
             print(f"Error while processing: {url}")
             return None
 
 
+    @staticmethod
+    def head(html, chunk = 16384):
+
+        """
+
+        Find the <meta> and <link> tags of a page's <head>, feeding
+        the page to an incremental parser only until the head ends (at
+        </head>, or the first tag that belongs in the body).
+
+        Returns:
+
+            dict with lists of the "meta" and "link" elements
+
+        """
+
+        tags = {"meta": [], "link": []}
+
+        parser = etree.HTMLPullParser(events = ("start", "end"))
+
+        try:
+
+            for start in range(0, len(html), chunk):
+
+                parser.feed(html[start:start + chunk])
+
+                for event, element in parser.read_events():
+
+                    if event == "start" and element.tag == "body" \
+                            or event == "end" and element.tag == "head":
+
+                        return tags
+
+                    if event == "end" and element.tag in ("meta", "link"):
+
+                        tags[element.tag].append(element)
+
+        except etree.Error:
+
+            pass
+
+        return tags
+
+
     @staticmethod
     def same_domain(url1, url2):
 
@@ -0,0 +1,253 @@
+import collections, os, threading, time, ujson
+
+
+# Seconds to wait before a later run retries a URL, by error class, doubled
+# for every earlier attempt. None means the URL is never retried, except
+# pages refused by the size or type limits once those allow them (see due).
+
+backoff = {
+    "throttled":  60,     # 429, 503
+    "timeout":    60,
+    "connection": 300,    # refused, reset, DNS
+    "server":     600,    # other 5xx
+    "error":      600,    # anything else
+    "missing":    None,   # 404, 410
+    "client":     None,   # other 4xx
+    "too_large":  None,   # body over the size limit
+    "not_html":   None,   # Content-Type is not HTML
+}
+
+
+# Longest wait before a retry on a later run.
+
+_longest = 24 * 60 * 60
+
+
+def classify(status):
+
+    """
+
+    Error class of a download that got an HTTP status other than 200.
+
+    """
+
+    if status in (429, 503):
+
+        return "throttled"
+
+    elif status in (404, 410):
+
+        return "missing"
+
+    elif status >= 500:
+
+        return "server"
+
+    elif status >= 400:
+
+        return "client"
+
+    return "error"
+
+
+def retryable(outcome):
+
+    """
+
+    Whether a download that failed this way may succeed if tried again.
+
+    """
+
+    return backoff.get(outcome, 0) is not None
+
+
+class Journal(object):
+
+    def __init__(self, path):
+
+        """
+
+        Append-only JSON lines log of the final outcome of every download:
+        URL, outcome ("ok" or an error class), HTTP status, attempts made
+        over all runs and a timestamp. Each record is flushed as soon as
+        it is written, so the log survives the process being killed, and
+        a partly written last line is skipped when reading. Successes only
+        keep their URL in memory.
+
+        Example:
+
+            >>> journal = Journal("dev.archive.journal")
+            >>> journal.record(url, "missing", status = 404, attempts = 1)
+            >>> journal.due(url)
+            False
+
+        """
+
+        self.path = path
+        self.last = {}
+        self.ok = set()
+        self.counts = collections.Counter()
+
+        self._lock = threading.Lock()
+
+        partial = False
+
+        if os.path.isfile(path):
+
+            with open(path, "rt") as f:
+
+                for line in f:
+
+                    partial = not line.endswith("\n")
+
+                    try:
+
+                        entry = ujson.loads(line)
+
+                    except ValueError:
+
+                        continue
+
+                    self._keep(entry)
+
+        self.file = open(path, "at")
+
+        # End a line left partly written by a killed run, so the next
+        # record starts a line of its own.
+
+        if partial:
+
+            self.file.write("\n")
+            self.file.flush()
+
+
+    def __contains__(self, url):
+
+        return url in self.last or url in self.ok
+
+
+    def get(self, url):
+
+        """
+
+        Latest record of url, or None if it was never tried. For a URL
+        whose last download succeeded, only the URL and outcome are kept.
+
+        """
+
+        if url in self.ok:
+
+            return {"url": url, "outcome": "ok"}
+
+        return self.last.get(url)
+
+
+    def record(self, url, outcome, status = None, attempts = 1, limit = None):
+
+        """
+
+        Log the final outcome of url after attempts tries in this run.
+        For "too_large", limit is the size limit (bytes) it exceeded.
+        Outcomes arriving after close() (downloads that finish after the
+        run was stopped) are dropped; those URLs are tried again later.
+
+        """
+
+        with self._lock:
+
+            if self.file.closed:
+
+                return
+
+            previous = self.last.get(url)
+
+            if previous is not None:
+
+                attempts += previous["attempts"]
+
+            entry = {
+                "url": url,
+                "outcome": outcome,
+                "status": status,
+                "attempts": attempts,
+                "time": time.time(),
+            }
+
+            if limit is not None:
+
+                entry["limit"] = limit
+
+            self._keep(entry)
+            self.counts[outcome] += 1
+
+            self.file.write(ujson.dumps(entry) + "\n")
+            self.file.flush()
+
+
+    def due(self, url, now = None, max_size = None, html_only = True):
+
+        """
+
+        Whether url should be downloaded now: it was never tried, or its
+        last failure is retryable and its backoff has passed. Callers only
+        ask about URLs missing from the archive, so a URL logged as "ok"
+        was lost before it was written, and is due as well.
+
+        Pages refused for their size or type are due once the current
+        settings (as given to the Downloader) would accept them: max_size
+        is unlimited (None) or above the limit they exceeded, or html_only
+        is off.
+
+        """
+
+        entry = self.last.get(url)
+
+        if entry is None:
+
+            return True
+
+        if entry["outcome"] == "too_large":
+
+            limit = entry.get("limit")
+
+            return max_size is None or (limit is not None and max_size > limit)
+
+        if entry["outcome"] == "not_html":
+
+            return not html_only
+
+        wait = backoff.get(entry["outcome"], 0)
+
+        if wait is None:
+
+            return False
+
+        wait = min(_longest, wait * 2 ** max(0, entry["attempts"] - 1))
+
+        return (now or time.time()) >= entry["time"] + wait
+
+
+    def close(self):
+
+        # Wait for a record being written by a worker thread.
+
+        with self._lock:
+
+            self.file.close()
+
+
+    def _keep(self, entry):
+
+        # Latest record of a URL, of which successes keep only the URL.
+
+        url = entry["url"]
+
+        if entry["outcome"] == "ok":
+
+            self.last.pop(url, None)
+            self.ok.add(url)
+
+        else:
+
+            self.ok.discard(url)
+            self.last[url] = entry
@@ -1,26 +1,54 @@
-import bz2    as _bz2
-import gzip   as _gzip
-import lzma   as _lzma
-import os     as _os
-import shlex  as _shlex
-import shutil as _shutil
-import ujson  as _json
+import bisect      as _bisect
+import bz2         as _bz2
+import collections as _collections
+import functools   as _functools
+import gzip        as _gzip
+import io          as _io
+import itertools   as _itertools
+import lzma        as _lzma
+import mmap        as _mmap
+import os          as _os
+import re          as _re
+import shutil      as _shutil
+import sqlite3     as _sqlite3
+import struct      as _struct
+import subprocess  as _subprocess
+import ujson       as _json
+import zlib        as _zlib
+
+from concurrent import futures as _futures
+
+try:
+
+    import zstandard as _zstd
+
+except ImportError:
+
+    _zstd = None
 
 _open = open
 
 _has = {
-    "zcat":  not not _shutil.which("zcat"),
-    "bzcat": not not _shutil.which("bzcat"),
-    "xzcat": not not _shutil.which("xzcat"),
+    "zcat":   not not _shutil.which("zcat"),
+    "bzcat":  not not _shutil.which("bzcat"),
+    "xzcat":  not not _shutil.which("xzcat"),
+    "zstd":   not not _shutil.which("zstd"),
+    "pigz":   not not _shutil.which("pigz"),
+    "pbzip2": not not _shutil.which("pbzip2"),
+    "xz":     not not _shutil.which("xz"),
 }
 
+# Buffer size of the pipes to and from external tools.
+
+_PIPE_BUFFER = 1 << 20
+
 
 class open(object):
 
     """
 
     Simple tool for manipulating compressed JSON line data files.
-    Supports gzip, bzip2, xz/lzma and uncompressed JSON line input.
+    Supports gzip, bzip2, xz/lzma, zstd and uncompressed JSON line input.
     Can be used as a standard object, or in a "with" context.
 
     Uses faster system tools for expanding files when available.
@@ -30,17 +58,77 @@ class open(object):
         - 20x read speed increase for gzip
         - 5x read speed increase for bzip2
 
+    Multi-threaded tools (pigz, pbzip2, xz -T0, zstd -T0) are preferred
+    and also used for writing, except for gzip blocks.
+
     Arguments:
 
         path (str) - path of JSON lines file
 
     Keywords:
 
-        fast (bool) - read with zcat, bzcat, or xzcat (default = True)
+        fast (bool) - read and write with system tools (default = True)
         gzip (bool) - encode and decode with gzip (default = False)
         bzip (bool) - encode and decode with bzip2 (default = False)
         xz (bool)   - encode and decode with xz/lzma (default = False)
-        level (int) - compression level for gzip and bzip2 (default = 9)
+        zstd (bool) - encode and decode with zstd (default = False)
+        level (int) - compression level for gzip, bzip2 and zstd (default = 9)
+        buffer (int) - lines held in memory before writing (default = 1000)
+        buffer_bytes (int) - bytes held in memory before writing
+            (default = 4 MB)
+        index (bool) - keep a sidecar line index (default = False)
+        blocks (bool) - write gzip as independent blocks (default = False)
+        workers (int) - threads expanding blocks when reading (default = 1)
+        mmap (bool) - read uncompressed files from a memory map
+            (default = False)
+        key (str) - top-level key to keep a lookup table for, e.g.
+            "archive" (default = None)
+
+    Lines are buffered and written in large blocks whenever either buffer
+    limit is reached, and on flush() or close(). Each flush of a compressed
+    file writes one complete gzip, bzip2 or xz member (or zstd frame), so
+    a writer killed between flushes loses only its buffered lines. The
+    file is always opened in append mode, so interrupted runs can be
+    resumed.
+
+    With index enabled, a small binary file is kept next to the data
+    (path + ".index"). It holds one (byte offset, line number) pair per
+    block, marking where the block ends and the next one begins. A block
+    is one flush, i.e. one compressed member; uncompressed files are split
+    every buffer lines when reindexed. The index is extended whenever a block is
+    written, read once per object, and rebuilt automatically (or with
+    reindex()) if it no longer matches the data file. It makes len()
+    constant time and lets get() and slice() start at the enclosing block
+    without decoding everything before it.
+
+    With blocks enabled (gzip only), every flush writes its lines as a
+    separate gzip member whose header records the member size in an extra
+    field, similar to BGZF. The result is still a valid gzip file for zcat
+    and the gzip module, but readers can find every block from the headers
+    alone. ranges() and readrange() let callers split work by block, and
+    with workers > 1 readlines() decompresses blocks in a thread pool.
+
+    With mmap enabled, uncompressed files are read through a read-only
+    memory map: lines are found with find() in the mapped buffer and the
+    bytes of each line go straight to the decoder, without building an
+    intermediate str. ranges(parts) splits uncompressed files into byte
+    ranges on line boundaries, so several processes can each map the same
+    file and read their own range with readrange().
+
+    With a key, a SQLite table (path + ".keys") maps each value of that key
+    to the number of the first line holding it. It is updated with every
+    write and rebuilt by a single scan if the data file was changed
+    without it. Membership tests ("url" in f), lookup() and keys() then
+    answer without reading the data file.
+
+    While reading, tell() reports how many bytes of the data file have been
+    consumed, so progress can be measured against its size without counting
+    lines first.
+
+    zstd requires the zstandard package (the zstd tool is enough for fast
+    reading). If a dictionary trained with newsroom-dictionary is stored
+    next to the file (path + ".dict"), it is used for both compression
+    and decompression.
 
     """
 
@@ -52,7 +140,15 @@ class open(object):
             gzip  = False,
             bzip  = False,
             xz    = False,
+            zstd  = False,
             level = 9,
+            buffer = 1000,
+            buffer_bytes = 4 << 20,
+            index = False,
+            blocks = False,
+            workers = 1,
+            mmap = False,
+            key = None,
 
             ):
 
@@ -63,21 +159,106 @@ class open(object):
         self.use_gzip = gzip
         self.use_bzip = bzip
         self.use_xz   = xz
+        self.use_zstd = zstd
 
         self.level    = level
 
+        self.buffer       = max(1, buffer)
+        self.buffer_bytes = buffer_bytes
+
         self.is_read  = None
         self.file     = None
 
+        self._source   = None
+        self._position = 0
+
+        self._pending       = []
+        self._pending_bytes = 0
+
+        self.use_index = index
+
+        self._ends    = None
+        self._block   = None
+        self._written = 0
+
+        self.use_blocks = blocks
+        self.workers    = max(1, workers)
+
+        self.use_mmap = mmap
+
+        self.key = key
+
+        self._db          = None
+        self._keylines    = 0
+        self._keychanges  = False
+        self._pendingkeys = []
+
         # Allow only one compressor.
 
-        assert sum([gzip, bzip, xz]) <= 1
+        assert sum([gzip, bzip, xz, zstd]) <= 1
+
+        # Blocks are gzip members.
+
+        assert gzip or not blocks
 
         # Fast only if system supports it.
 
-        self.fast &= (gzip and _has["zcat"]) \
-            or (bzip and _has["bzcat"]) \
-            or (xz and _has["xzcat"])
+        self.fast &= (gzip and (_has["pigz"] or _has["zcat"])) \
+            or (bzip and (_has["pbzip2"] or _has["bzcat"])) \
+            or (xz and (_has["xz"] or _has["xzcat"])) \
+            or (zstd and _has["zstd"])
+
+
+    def _command(self, write = False):
+
+        # System tool for the fast path, preferring multi-threaded ones,
+        # or None if only the Python codec can be used.
+
+        level = "-" + str(self.level)
+
+        if self.use_gzip:
+
+            if _has["pigz"]:
+
+                return ["pigz", "-c", level] if write else ["pigz", "-dc"]
+
+            return None if write else ["zcat"]
+
+        elif self.use_bzip:
+
+            if _has["pbzip2"]:
+
+                return ["pbzip2", "-c", level] if write else ["pbzip2", "-dc"]
+
+            return None if write else ["bzcat"]
+
+        elif self.use_xz:
+
+            if _has["xz"]:
+
+                return ["xz", "-c", "-T0"] if write else ["xz", "-dc", "-T0"]
+
+            return None if write else ["xzcat"]
+
+        elif self.use_zstd:
+
+            command = ["zstd", "-q", "-T0"]
+
+            if write:
+
+                command += ["-c", level] + (["--ultra"] if self.level > 19 else [])
+
+            else:
+
+                command += ["-dc"]
+
+            dictionary = self.path + ".dict"
+
+            if _os.path.isfile(dictionary):
+
+                command += ["-D", dictionary]
+
+            return command
 
 
     def _readfile(self):
@@ -88,47 +269,47 @@ class open(object):
 
         self.is_read = True
 
-        if self.use_gzip:
-
-            if self.fast:
+        # The compressed input is opened here and handed to the decoder,
+        # so tell() can follow its offset.
 
-                quoted = _shlex.quote(self.path)
-                self.file = _os.popen("zcat < " + quoted)
-
-            else:
+        self._position = 0
 
-                self.file = _gzip.open(
-                    self.path, mode = "rt",
-                    compresslevel = self.level)
+        if self.fast:
 
-        elif self.use_bzip:
+            self.file    = _pipe(self._command(), self.path, "r")
+            self._source = self.file.source
 
-            if self.fast:
+        elif self.use_gzip:
 
-                quoted = _shlex.quote(self.path)
-                self.file = _os.popen("bzcat < " + quoted)
+            self._source = _open(self.path, "rb")
+            self.file    = _gzip.open(
+                self._source, mode = "rt",
+                compresslevel = self.level)
 
-            else:
+        elif self.use_bzip:
 
-                self.file = _bz2.open(
-                    self.path, mode = "rt",
-                    compresslevel = self.level)
+            self._source = _open(self.path, "rb")
+            self.file    = _bz2.open(
+                self._source, mode = "rt",
+                compresslevel = self.level)
 
         elif self.use_xz:
 
-            if self.fast:
-
-                quoted = _shlex.quote(self.path)
-                self.file = _os.popen("xzcat < " + quoted)
+            self._source = _open(self.path, "rb")
+            self.file    = _lzma.open(
+                self._source, mode = "rt")
 
-            else:
+        elif self.use_zstd:
 
-                self.file = _lzma.open(
-                    self.path, mode = "rt")
+            self._source = _open(self.path, "rb")
+            self.file    = _io.TextIOWrapper(
+                self._decompress(self._source),
+                encoding = "utf-8")
 
         else:
 
-            self.file = _open(self.path, "r")
+            self.file    = _open(self.path, "r")
+            self._source = self.file
 
         return self.file
 
@@ -139,9 +320,38 @@ class open(object):
 
             self.close()
 
+        # Reuse the open file between writes. Compressed streams other than
+        # blocks are closed on every flush, and reopened here.
+
+        elif self.is_read is False and self.file:
+
+            return self.file
+
         self.is_read = False
 
-        if self.use_gzip:
+        # Start a new index block for the lines written next.
+
+        if self.use_index:
+
+            self._startblock()
+
+        # Make sure the key table matches the file before extending it.
+
+        if self.key is not None:
+
+            self._keydb()
+
+        command = self._command(write = True) if self.fast else None
+
+        if self.use_blocks:
+
+            self.file = _open(self.path, "ab")
+
+        elif command is not None:
+
+            self.file = _pipe(command, self.path, "a")
+
+        elif self.use_gzip:
 
             self.file = _gzip.open(
                 self.path, mode = "at",
@@ -158,6 +368,12 @@ class open(object):
             self.file = _lzma.open(
                 self.path, mode = "at")
 
+        elif self.use_zstd:
+
+            self.file = _io.TextIOWrapper(
+                self._zstdcompressor().stream_writer(_open(self.path, "ab")),
+                encoding = "utf-8")
+
         else:
 
             self.file = _open(self.path, "a+")
@@ -195,6 +411,30 @@ class open(object):
 
     def __len__(self):
 
+        # A fresh line index already knows the answer.
+
+        if self.use_index:
+
+            if not self.is_read:
+
+                self.close()
+
+            length = self._indexed()
+
+            if length is None:
+
+                try:
+
+                    length = self._reindex()
+
+                except OSError:
+
+                    pass
+
+            if length is not None:
+
+                return length
+
         length = 0
 
         for line in self._readfile():
@@ -204,219 +444,1688 @@ class open(object):
         return length
 
 
-    def close(self):
+    def _indexpath(self):
 
-        """
+        return self.path + ".index"
 
-        Close the file.
 
-        """
+    def _size(self):
 
-        if self.file:
+        try:
 
-            self.file.close()
+            return _os.path.getsize(self.path)
 
+        except OSError:
 
-    def delete(self):
+            return 0
 
-        """
 
-        Delete the file contents on disk.
+    def _decompress(self, raw):
 
-        """
+        # Decompressing reader starting at the current position of raw.
 
-        if self.is_read is True:
+        if self.use_gzip:
 
-            self.close()
+            return _gzip.GzipFile(fileobj = raw, mode = "rb")
 
-        self.is_read = False
+        elif self.use_bzip:
+
+            return _bz2.BZ2File(raw, mode = "rb")
+
+        elif self.use_xz:
+
+            return _lzma.LZMAFile(raw, mode = "rb")
+
+        elif self.use_zstd:
+
+            return _io.BufferedReader(
+                self._zstddecompressor().stream_reader(
+                    raw, read_across_frames = True))
+
+        else:
+
+            return raw
+
+
+    def _decompressor(self):
+
+        # Incremental decompressor for a single compressed member.
 
         if self.use_gzip:
 
-            self.file = _gzip.open(
-                self.path, mode = "wt",
-                compresslevel = self.level)
+            return _zlib.decompressobj(16 + _zlib.MAX_WBITS)
 
         elif self.use_bzip:
 
-            self.file = _bz2.open(
-                self.path, mode = "wt",
-                compresslevel = self.level)
+            return _bz2.BZ2Decompressor()
 
-        elif self.use_bzip:
+        elif self.use_xz:
 
-            self.file = _lzma.open(
-                self.path, mode = "wt")
+            return _lzma.LZMADecompressor()
+
+        elif self.use_zstd:
+
+            return self._zstddecompressor().decompressobj()
 
         else:
 
-            self.file = _open(self.path, "w")
+            return None
 
-        self.file.close()
-        self.is_read = None
 
+    def _zstddictionary(self):
 
-    def readlines(self, ignore_errors = False):
+        # Trained dictionary stored next to the data file, if any.
 
-        """
+        path = self.path + ".dict"
 
-        Read a sequence of lines (as a generator).
+        if not _os.path.isfile(path):
 
-        Yields:
+            return None
 
-            individual JSON-decoded entries
+        with _open(path, "rb") as f:
 
-        """
+            return _zstandard().ZstdCompressionDict(f.read())
 
-        if not ignore_errors:
 
-            for line in self._readfile():
+    def _zstdcompressor(self):
 
-                yield _json.loads(line)
+        return _zstandard().ZstdCompressor(
+            level = self.level,
+            dict_data = self._zstddictionary())
 
-        else:
 
-            for ln, line in enumerate(self._readfile()):
+    def _zstddecompressor(self):
 
-                try:
+        return _zstandard().ZstdDecompressor(
+            dict_data = self._zstddictionary())
 
-                    yield _json.loads(line)
 
-                except:
+    def _boundaries(self):
 
-                    print("Decoding error on line", ln)
-                    continue
+        # The (offset, line) pairs of the index, read once and kept while
+        # they end where the data file ends. None if the index is missing
+        # or stale.
 
+        if self._ends is None:
 
-    def read(self):
+            try:
 
-        """
+                with _open(self._indexpath(), "rb") as f:
 
-        Read the entire file into memory.
+                    data = f.read()
 
-        Returns:
+            except OSError:
 
-            list of JSON-decoded entries
+                return None
 
-        """
+            if len(data) % _INDEX.size:
 
-        return list(self.readlines())
+                return None
 
+            self._ends = list(_INDEX.iter_unpack(data))
 
-    def appendline(self, entry):
+        end = self._ends[-1][0] if self._ends else 0
 
-        """
+        if end != self._size():
 
-        Write a single line to the file.
+            self._ends = None
+            return None
 
-        Arguments:
+        return self._ends
 
-            entry (object) - JSON-encodable object
 
-        """
+    def _indexed(self):
 
-        f = self._writefile()
-        f.write(_json.dumps(entry) + "\n")
+        # Number of lines according to the index, or None when the index
+        # is missing or does not end where the data file ends.
 
+        ends = self._boundaries()
 
-    def append(self, entries):
+        if ends is None:
 
-        """
+            return None
 
-        Append an entire list of lines to an existing file.
+        return ends[-1][1] if ends else 0
 
-        Arguments:
 
-            entry (iterable[object]) - iterable of JSON-encodable objects
+    def _blocks(self):
 
-        """
+        # All index blocks as (offset, length, first line, stop) tuples,
+        # rebuilding a stale index first. Returns None if no index can be
+        # used.
 
+        if not self.use_index:
 
-        for entry in entries:
-            self.appendline(entry)
+            return None
 
+        if not self.is_read:
 
-    def write(self, entries):
+            self.close()
 
-        """
+        ends = self._boundaries()
 
-        Write list of lines to file, overwriting the original data.
+        if ends is None:
 
-        Arguments:
+            try:
 
-            entry (iterable[object]) - iterable of JSON-encodable objects
+                self._reindex()
 
-        """
+            except OSError:
 
-        self.delete()
-        self.append(entries)
+                return None
 
+            ends = self._ends
 
-# Convenience functions.
+        blocks = []
+        offset = line = 0
 
+        for end, stop in ends:
 
-def read(*args, **kwargs):
+            blocks.append((offset, end - offset, line, stop))
+            offset, line = end, stop
 
-    """
+        return blocks
 
-    Read a full uncompressed JSON lines file into memory.
 
-    """
+    def _startblock(self):
 
-    kwargs["bzip"] = False
-    kwargs["gzip"] = False
-    kwargs["xz"]   = False
+        stop = self._indexed()
 
-    with open(*args, **kwargs) as f:
+        if stop is None:
 
-        return f.read()
+            stop = self._reindex()
 
+        self._block   = (self._size(), stop)
+        self._written = 0
 
-def bzread(*args, **kwargs):
 
-    """
+    def _endblock(self):
 
-    Read a full bzip2-compressed JSON lines file into memory.
+        (offset, start), self._block = self._block, None
 
-    """
+        end = (self._size(), start + self._written)
 
-    kwargs["bzip"] = True
-    kwargs["gzip"] = False
-    kwargs["xz"]   = False
+        if end[0] > offset or self._written:
 
-    with open(*args, **kwargs) as f:
+            with _open(self._indexpath(), "ab") as f:
 
-        return f.read()
+                f.write(_INDEX.pack(*end))
 
+            if self._ends is not None:
 
-def gzread(*args, **kwargs):
+                self._ends.append(end)
 
-    """
+        return end
 
-    Read a full gzip-compressed JSON lines file into memory.
 
-    """
+    def _expand(self, data):
 
-    kwargs["bzip"] = False
-    kwargs["gzip"] = True
-    kwargs["xz"]   = False
+        # Decompress a byte string made of whole compressed members.
 
-    with open(*args, **kwargs) as f:
+        decompressor = self._decompressor()
 
-        return f.read()
+        if decompressor is None:
 
+            return data
 
-def xzread(*args, **kwargs):
+        parts = []
 
-    """
+        while data:
 
-    Read a full xz/lzma-compressed JSON lines file into memory.
+            parts.append(decompressor.decompress(data))
 
-    """
+            if not decompressor.eof:
 
-    kwargs["bzip"] = False
-    kwargs["gzip"] = False
-    kwargs["xz"]   = True
+                break
+
+            data = decompressor.unused_data
+            decompressor = self._decompressor()
+
+        return b"".join(parts)
+
+
+    def _scanblocks(self):
+
+        # Offsets and sizes of the members of a block-compressed file,
+        # read from their headers. None if any member is not a block.
+
+        spans = []
+        size  = self._size()
+
+        with _open(self.path, "rb") as raw:
+
+            offset = 0
+
+            while offset < size:
+
+                raw.seek(offset)
+                length = _blocksize(raw.read(_BLOCK.size))
+
+                if length is None:
+
+                    return None
+
+                spans.append((offset, length))
+                offset += length
+
+        return spans
+
+
+    def _lines(self):
+
+        # Raw lines of the file, expanded in parallel when the file has
+        # several independent blocks and more than one worker is allowed.
+
+        if self.use_mmap and self._plain():
+
+            if not self.is_read:
+
+                self.close()
+
+            return self._maplines()
+
+        if self.workers > 1:
+
+            spans = self.ranges()
+
+            if len(spans) > 1:
+
+                return self._parallel(spans)
+
+        return self._readfile()
+
+
+    def _plain(self):
+
+        return not (self.use_gzip or self.use_bzip
+                    or self.use_xz or self.use_zstd)
+
+
+    def _maplines(self, offset = 0, length = None):
+
+        # Lines of an uncompressed file as bytes slices of a memory map.
+
+        size = self._size()
+
+        if size == 0:
+
+            return
+
+        end = size if length is None else min(size, offset + length)
+
+        with _open(self.path, "rb") as raw:
+            with _mmap.mmap(raw.fileno(), 0, access = _mmap.ACCESS_READ) as buf:
+
+                position = offset
+
+                while position < end:
+
+                    newline = buf.find(b"\n", position, end)
+
+                    if newline < 0:
+
+                        newline = end
+
+                    self._position = newline + 1
+
+                    yield buf[position : newline]
+                    position = newline + 1
+
+
+    def _linespans(self, parts):
+
+        # Split an uncompressed file into parts byte ranges that start and
+        # end on line boundaries.
+
+        size   = self._size()
+        starts = [0]
+
+        with _open(self.path, "rb") as raw:
+
+            for part in range(1, parts):
+
+                raw.seek(size * part // parts)
+                raw.readline()
+
+                if raw.tell() > starts[-1]:
+
+                    starts.append(raw.tell())
+
+        ends = starts[1:] + [size]
+
+        return [
+            (start, end - start)
+            for start, end in zip(starts, ends)
+            if end > start
+        ]
+
+
+    def _parallel(self, spans):
+
+        with _open(self.path, "rb") as raw:
+
+            fd = raw.fileno()
+
+            def expand(span):
+
+                offset, length = span
+                return self._expand(_os.pread(fd, length, offset))
+
+            with _futures.ThreadPoolExecutor(self.workers) as executor:
+
+                expanded = _ordered(executor, expand, spans, 2 * self.workers)
+
+                for (offset, length), data in zip(spans, expanded):
+
+                    self._position = offset + length
+
+                    yield from _splitlines(data)
+
+
+    def _reindex(self):
+
+        # Scan the data file member by member (each flush writes one
+        # compressed member) and count the lines each one starts.
+        # Uncompressed files are split every buffer lines instead.
+
+        ends  = []
+        lines = 0
+
+        decompressor = self._decompressor()
+        consumed     = 0
+        new_line     = True
+
+        # A missing file is indexed as an empty one.
+
+        if _os.path.exists(self.path):
+
+            raw = _open(self.path, "rb")
+
+        else:
+
+            raw = _io.BytesIO()
+
+        with raw:
+
+            for chunk in iter(lambda: raw.read(1 << 20), b""):
+
+                while chunk:
+
+                    size = len(chunk)
+
+                    if decompressor is None:
+
+                        data, chunk, ended = chunk, b"", False
+
+                    else:
+
+                        data  = decompressor.decompress(chunk)
+                        ended = decompressor.eof
+                        chunk = decompressor.unused_data if ended else b""
+
+                    start     = consumed
+                    consumed += size - len(chunk)
+
+                    # Count the lines starting in this piece of data.
+
+                    i = 0
+
+                    while i < len(data):
+
+                        if new_line:
+
+                            last = ends[-1][1] if ends else 0
+
+                            if decompressor is None and lines - last >= self.buffer:
+
+                                ends.append((start + i, lines))
+
+                            lines   += 1
+                            new_line = False
+
+                        i = data.find(b"\n", i) + 1
+
+                        if i == 0:
+
+                            break
+
+                        new_line = True
+
+                    if ended:
+
+                        ends.append((consumed, lines))
+
+                        decompressor = self._decompressor()
+
+        # Keep whatever is left over (e.g. an unterminated member).
+
+        if consumed > (ends[-1][0] if ends else 0):
+
+            ends.append((consumed, lines))
+
+        with _open(self._indexpath(), "wb") as f:
+
+            f.write(b"".join(_INDEX.pack(*end) for end in ends))
+
+        self._ends = ends
+
+        return lines
+
+
+    def _reader(self):
+
+        # Independent reader for the same file, used to rebuild sidecars
+        # without disturbing this object's open stream.
+
+        return type(self)(
+            self.path,
+            fast    = self.fast,
+            gzip    = self.use_gzip,
+            bzip    = self.use_bzip,
+            xz      = self.use_xz,
+            zstd    = self.use_zstd,
+            workers = self.workers,
+            mmap    = self.use_mmap,
+        )
+
+
+    def _keydb(self):
+
+        # Connection to the key table, rebuilt first if it does not
+        # describe the current data file.
+
+        if self._db is not None:
+
+            return self._db
+
+        self._db = _sqlite3.connect(self.path + ".keys")
+
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS keys "
+            "(key TEXT PRIMARY KEY, line INTEGER) WITHOUT ROWID")
+
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS meta "
+            "(name TEXT PRIMARY KEY, value)")
+
+        meta = dict(self._db.execute("SELECT name, value FROM meta"))
+
+        if meta.get("key") != self.key or meta.get("size") != self._size():
+
+            self._rekey()
+
+        else:
+
+            self._keylines = meta["lines"]
+
+        return self._db
+
+
+    def _rekey(self):
+
+        db = self._keydb()
+
+        db.execute("DELETE FROM keys")
+
+        self._keylines = 0
+
+        if self._size() > 0:
+
+            reader = self._reader()
+            load   = _loader([self.key])
+
+            def rows():
+
+                for line, text in enumerate(reader._lines()):
+
+                    self._keylines += 1
+
+                    try:
+
+                        value = load(text).get(self.key)
+
+                    except ValueError:
+
+                        continue
+
+                    if value is not None:
+
+                        yield value, line
+
+            db.executemany("INSERT OR IGNORE INTO keys VALUES (?, ?)", rows())
+
+        self._savekeys()
+
+
+    def _addkeys(self, keys):
+
+        rows = [
+            (value, self._keylines + i)
+            for i, value in enumerate(keys)
+            if value is not None
+        ]
+
+        self._keylines  += len(keys)
+        self._keychanges = True
+        self._keydb().executemany(
+            "INSERT OR IGNORE INTO keys VALUES (?, ?)", rows)
+
+
+    def _savekeys(self):
+
+        self._db.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                ("key", self.key),
+                ("size", self._size()),
+                ("lines", self._keylines),
+            ])
+
+        self._db.commit()
+
+        self._keychanges = False
+
+
+    def __contains__(self, value):
+
+        if self.key is None:
+
+            return any(entry == value for entry in self)
+
+        return self.lookup(value) is not None
+
+
+    def lookup(self, value):
+
+        """
+
+        Find the first line whose key (see the key keyword) equals value.
+
+        Returns:
+
+            line number for get() or slice(), or None if not present
+
+        """
+
+        if self.key is None:
+
+            raise ValueError("lookup() requires the key keyword")
+
+        # Buffered lines are written (and their keys added) first, but the
+        # file stays open and nothing is committed.
+
+        if self._pending:
+
+            self.flush()
+
+        row = self._keydb().execute(
+            "SELECT line FROM keys WHERE key = ?", (value,)).fetchone()
+
+        return row[0] if row else None
+
+
+    def keys(self):
+
+        """
+
+        Read every value of the key (see the key keyword) from the lookup
+        table, e.g. to load the finished URLs of a dataset into a set.
+
+        Returns:
+
+            list of key values, in no particular order
+
+        """
+
+        if self.key is None:
+
+            raise ValueError("keys() requires the key keyword")
+
+        if self._pending:
+
+            self.flush()
+
+        return [value for value, in self._keydb().execute("SELECT key FROM keys")]
+
+
+    def tell(self):
+
+        """
+
+        Bytes of the data file consumed by the current (or last) reader,
+        for progress against the file size. Decompressors read ahead, so
+        this runs a little ahead of the lines returned so far.
+
+        """
+
+        source = self._source
+
+        # The offset is that of the open file description, which a system
+        # tool reading the file shares with our copy of it.
+
+        if source is not None and not source.closed:
+
+            self._position = _os.lseek(source.fileno(), 0, _os.SEEK_CUR)
+
+        return self._position
+
+
+    def close(self):
+
+        """
+
+        Close the file, writing any buffered lines first.
+
+        """
+
+        if self.file or self._pending:
+
+            self.flush()
+
+        self.tell()
+
+        if self.file:
+
+            self.file.close()
+            self.file = None
+
+        if self._source is not None:
+
+            self._source.close()
+            self._source = None
+
+        if self._block is not None:
+
+            self._endblock()
+
+        # Only writes change the key table; reads leave it as it is.
+
+        if self._keychanges:
+
+            self._savekeys()
+
+
+    def flush(self):
+
+        """
+
+        Write buffered lines to the file. Compressed files get a complete
+        member (or frame) per flush, so a writer killed later leaves a file
+        the next session can append to.
+
+        """
+
+        if not self._pending:
+
+            return
+
+        pending = self._pending
+        keys    = self._pendingkeys
+
+        self._pending       = []
+        self._pending_bytes = 0
+        self._pendingkeys   = []
+
+        f = self._writefile()
+
+        if self.key is not None:
+
+            self._addkeys(keys)
+
+        if self._block is not None:
+
+            self._written += len(pending)
+
+        if self.use_blocks:
+
+            # Each flush is a self-contained block.
+
+            f.write(_gzipblock("".join(pending).encode("utf-8"), self.level))
+            f.flush()
+
+        elif self._plain():
+
+            f.write("".join(pending))
+            f.flush()
+
+        else:
+
+            # Closing the stream finishes its member (or frame), which then
+            # starts a block as well.
+
+            f.write("".join(pending))
+            f.close()
+
+            self.file = None
+
+        if self._block is not None:
+
+            self._block   = self._endblock()
+            self._written = 0
+
+
+    def delete(self):
+
+        """
+
+        Delete the file contents on disk.
+
+        """
+
+        # Drop anything still buffered for the old contents.
+
+        self._pending       = []
+        self._pending_bytes = 0
+        self._pendingkeys   = []
+
+        self.close()
+
+        self.is_read = False
+
+        if self.use_blocks:
+
+            self.file = _open(self.path, "wb")
+            self.file.write(_gzipblock(b"", self.level))
+
+        elif self.use_gzip:
+
+            self.file = _gzip.open(
+                self.path, mode = "wt",
+                compresslevel = self.level)
+
+        elif self.use_bzip:
+
+            self.file = _bz2.open(
+                self.path, mode = "wt",
+                compresslevel = self.level)
+
+        elif self.use_xz:
+
+            self.file = _lzma.open(
+                self.path, mode = "wt")
+
+        elif self.use_zstd:
+
+            self.file = _open(self.path, "wb")
+            self.file.write(self._zstdcompressor().compress(b""))
+
+        else:
+
+            self.file = _open(self.path, "w")
+
+        self.file.close()
+        self.file    = None
+        self.is_read = None
+
+        if self.use_index:
+
+            self._reindex()
+
+        if self.key is not None:
+
+            self._rekey()
+
+
+    def reindex(self):
+
+        """
+
+        Rebuild the sidecar line index from the data file.
+
+        Returns:
+
+            number of lines in the file
+
+        """
+
+        self.close()
+
+        return self._reindex()
+
+
+    def get(self, i):
+
+        """
+
+        Read a single line by its line number.
+
+        Returns:
+
+            JSON-decoded entry
+
+        """
+
+        if i < 0:
+
+            i += len(self)
+
+        for entry in self.slice(i, i + 1):
+
+            return entry
+
+        raise IndexError("line {} out of range".format(i))
+
+
+    def slice(self, start = 0, stop = None):
+
+        """
+
+        Read lines start to stop (exclusive) as a generator. With a line
+        index, reading starts at the enclosing block rather than at the
+        beginning of the file.
+
+        Yields:
+
+            individual JSON-decoded entries
+
+        """
+
+        blocks = self._blocks()
+
+        if blocks is None:
+
+            yield from _itertools.islice(self.readlines(), start, stop)
+            return
+
+        total = blocks[-1][3] if blocks else 0
+        stop  = total if stop is None else min(stop, total)
+
+        if start >= stop:
+
+            return
+
+        stops = [block[3] for block in blocks]
+        offset, _, first, _ = blocks[_bisect.bisect_right(stops, start)]
+
+        with _open(self.path, "rb") as raw:
+
+            raw.seek(offset)
+            stream = self._decompress(raw)
+            head   = _io.BytesIO(_skiplines(stream, start - first))
+
+            for _ in range(stop - start):
+
+                line = head.readline()
+
+                if not line.endswith(b"\n"):
+
+                    line += stream.readline()
+
+                yield _json.loads(line)
+
+
+    def ranges(self, parts = None):
+
+        """
+
+        Split the file into byte ranges that can be decompressed
+        independently: the blocks of a block-compressed file, or the
+        blocks of a fresh line index. Other compressed files form a
+        single range. Uncompressed files are split on line boundaries.
+
+        Arguments:
+
+            parts (int) - merge neighbouring blocks into about this many
+                ranges of similar size (default = one range per block)
+
+        Returns:
+
+            list of (offset, length) tuples
+
+        """
+
+        if not self.is_read:
+
+            self.close()
+
+        spans = None
+
+        if parts and self._plain():
+
+            return self._linespans(parts)
+
+        if self.use_index and self._indexed() is not None:
+
+            spans = [
+                (offset, length)
+                for offset, length, _, _ in self._blocks()
+                if length > 0
+            ]
+
+        elif self.use_gzip:
+
+            spans = self._scanblocks()
+
+        if spans is None:
+
+            size  = self._size()
+            spans = [(0, size)] if size > 0 else []
+
+        if parts:
+
+            spans = _merge(spans, parts)
+
+        return spans
+
+
+    def readrange(self, offset, length, keys = None):
+
+        """
+
+        Read the entries in a byte range returned by ranges().
+
+        Arguments:
+
+            keys (list) - only decode these top-level keys (default = all)
+
+        Yields:
+
+            individual JSON-decoded entries
+
+        """
+
+        loads = _loader(keys)
+
+        if self.use_mmap and self._plain():
+
+            for line in self._maplines(offset, length):
+
+                yield loads(line)
+
+            return
+
+        with _open(self.path, "rb") as raw:
+
+            raw.seek(offset)
+            data = self._expand(raw.read(length))
+
+        for line in _splitlines(data):
+
+            yield loads(line)
+
+
+    def readlines(self, ignore_errors = False, keys = None):
+
+        """
+
+        Read a sequence of lines (as a generator).
+
+        Arguments:
+
+            keys (list) - only decode these top-level keys; other values
+                are skipped over without being decoded (default = all)
+
+        Yields:
+
+            individual JSON-decoded entries
+
+        """
+
+        loads = _loader(keys)
+
+        if not ignore_errors:
+
+            for line in self._lines():
+
+                yield loads(line)
+
+        else:
+
+            for ln, line in enumerate(self._lines()):
+
+                try:
+
+                    yield loads(line)
+
+                except:
+
+                    print("Decoding error on line", ln)
+                    continue
+
+
+    def iter_batches(
+
+            self,
+            size,
+            processes = None,
+            ignore_errors = False,
+            keys = None,
+
+            ):
+
+        """
+
+        Read lists of up to size entries (as a generator). With processes,
+        raw lines are sent to a process pool in batches and decoded there,
+        still yielding batches in file order.
+
+        Arguments:
+
+            size (int) - entries per batch
+            processes (int) - decoding processes (default = decode here)
+            keys (list) - only decode these top-level keys (default = all)
+
+        Yields:
+
+            lists of JSON-decoded entries
+
+        """
+
+        batches = _batched(self._lines(), size)
+        decode  = _functools.partial(
+            _decode, ignore_errors = ignore_errors, keys = keys)
+
+        if not processes or processes <= 1:
+
+            for batch in batches:
+
+                yield decode(batch)
+
+            return
+
+        with _futures.ProcessPoolExecutor(processes) as executor:
+
+            yield from _ordered(executor, decode, batches, 2 * processes)
+
+
+    def read(self):
+
+        """
+
+        Read the entire file into memory.
+
+        Returns:
+
+            list of JSON-decoded entries
+
+        """
+
+        return list(self.readlines())
+
+
+    def appendline(self, entry):
+
+        """
+
+        Write a single line to the file.
+
+        Arguments:
+
+            entry (object) - JSON-encodable object
+
+        """
+
+        line = _json.dumps(entry) + "\n"
+
+        self._pending.append(line)
+        self._pending_bytes += len(line)
+
+        if self.key is not None:
+
+            self._pendingkeys.append(entry.get(self.key))
+
+        if len(self._pending) >= self.buffer \
+                or self._pending_bytes >= self.buffer_bytes:
+
+            self.flush()
+
+
+    def append(self, entries):
+
+        """
+
+        Append an entire list of lines to an existing file.
+
+        Arguments:
+
+            entry (iterable[object]) - iterable of JSON-encodable objects
+
+        """
+
+
+        for entry in entries:
+            self.appendline(entry)
+
+
+    def write(self, entries):
+
+        """
+
+        Write list of lines to file, overwriting the original data.
+
+        Arguments:
+
+            entry (iterable[object]) - iterable of JSON-encodable objects
+
+        """
+
+        self.delete()
+        self.append(entries)
+
+
+# Helpers.
+
+
+class _pipe(object):
+
+    # Binary pipe through a system (de)compressor. Reading yields bytes
+    # lines; writing takes str. A tool that exits with an error raises
+    # CalledProcessError (with its stderr) once the output is finished.
+
+    def __init__(self, command, path, mode = "r"):
+
+        self.command = command
+        self.ended   = False
+        self.file    = None
+        self.source  = None
+
+        if mode == "r":
+
+            source = _open(path, "rb")
+
+            self.process = _subprocess.Popen(
+                command,
+                stdin   = source,
+                stdout  = _subprocess.PIPE,
+                stderr  = _subprocess.PIPE,
+                bufsize = _PIPE_BUFFER)
+
+            self.file = self.process.stdout
+
+            # The child shares the offset of our copy of the file, which
+            # shows how far it has read. The caller closes it.
+
+            self.source = source
+
+        else:
+
+            source = _open(path, "ab")
+
+            self.process = _subprocess.Popen(
+                command,
+                stdin   = _subprocess.PIPE,
+                stdout  = source,
+                stderr  = _subprocess.PIPE,
+                bufsize = _PIPE_BUFFER)
+
+            self.file = self.process.stdin
+
+            # The child keeps its own copy of the file.
+
+            source.close()
+
+
+    def __iter__(self):
+
+        yield from self.file
+
+        self.ended = True
+        self.close()
+
+
+    def __del__(self):
+
+        self.close()
+
+
+    def write(self, text):
+
+        return self.file.write(text.encode("utf-8"))
+
+
+    def flush(self):
+
+        self.file.flush()
+
+
+    def close(self):
+
+        if self.file is None or self.file.closed:
+
+            return
+
+        self.file.close()
+
+        # A reader closed before the end stops the tool with SIGPIPE,
+        # which is not an error.
+
+        reading = self.file is self.process.stdout
+        code    = self.process.wait()
+        stderr  = self.process.stderr.read()
+
+        self.process.stderr.close()
+
+        if code != 0 and (self.ended or not reading):
+
+            raise _subprocess.CalledProcessError(
+                code, self.command, stderr = stderr)
+
+
+def _zstandard():
+
+    if _zstd is None:
+
+        raise ImportError(
+            "zstd support requires the zstandard package "
+            "(pip install zstandard)")
+
+    return _zstd
+
+
+# Block header: gzip magic, deflate, FEXTRA flag, mtime, xfl, os (unknown),
+# extra field length, then an "NR" subfield holding the total member size.
+
+_BLOCK = _struct.Struct("<4BIBBH2sHI")
+
+# Line index entry: byte offset and line number at the end of a block.
+
+_INDEX = _struct.Struct("<QQ")
+
+
+def _gzipblock(data, level):
+
+    # Compress data into a single gzip member with a block header.
+
+    deflate = _zlib.compressobj(level, _zlib.DEFLATED, -_zlib.MAX_WBITS)
+    body    = deflate.compress(data) + deflate.flush()
+    size    = _BLOCK.size + len(body) + 8
+
+    header  = _BLOCK.pack(0x1f, 0x8b, 8, 4, 0, 0, 255, 8, b"NR", 4, size)
+    trailer = _struct.pack("<II", _zlib.crc32(data), len(data) & 0xffffffff)
+
+    return header + body + trailer
+
+
+def _blocksize(header):
+
+    # Size of the gzip member starting with header, or None if it is
+    # not a block written by _gzipblock.
+
+    if len(header) < _BLOCK.size:
+
+        return None
+
+    id1, id2, method, flags, _, _, _, xlen, field, flen, size = \
+        _BLOCK.unpack(header)
+
+    if (id1, id2, method) != (0x1f, 0x8b, 8) or not flags & 4:
+
+        return None
+
+    if xlen != 8 or field != b"NR" or flen != 4:
+
+        return None
+
+    return size
+
+
+def _skiplines(stream, count):
+
+    # Skip count lines of a stream that may not support seeking, a chunk at
+    # a time. Returns the data read past them.
+
+    while count > 0:
+
+        data  = stream.read(1 << 20)
+        lines = data.count(b"\n")
+
+        if lines < count:
+
+            if not data:
+
+                break
+
+            count -= lines
+            continue
+
+        return data.split(b"\n", count)[-1]
+
+    return b""
+
+
+def _splitlines(data):
+
+    lines = data.split(b"\n")
+
+    if lines[-1] == b"":
+
+        lines.pop()
+
+    return lines
+
+
+def _batched(lines, size):
+
+    # Group lines into (first line number, list of lines) batches.
+
+    lines = iter(lines)
+    first = 0
+
+    while True:
+
+        batch = list(_itertools.islice(lines, max(1, size)))
+
+        if not batch:
+
+            return
+
+        yield first, batch
+        first += len(batch)
+
+
+def _decode(batch, ignore_errors = False, keys = None):
+
+    first, lines = batch
+    loads = _loader(keys)
+
+    if not ignore_errors:
+
+        return [loads(line) for line in lines]
+
+    entries = []
+
+    for ln, line in enumerate(lines, first):
+
+        try:
+
+            entries.append(loads(line))
+
+        except:
+
+            print("Decoding error on line", ln)
+            continue
+
+    return entries
+
+
+def _loader(keys):
+
+    if keys is None:
+
+        return _json.loads
+
+    quoted = [_json.dumps(key).encode("utf-8") for key in keys]
+
+    return _functools.partial(
+        _project, keys = frozenset(keys), quoted = quoted)
+
+
+# Projection: decode selected top-level keys of a JSON object line. Only
+# the first _PREFIX bytes are parsed here, stepping over other values with
+# regular expressions, so keys stored before large strings (e.g. page HTML)
+# are read without decoding them. Keys not found there are left to ujson,
+# which decodes a whole line faster than its strings can be stepped over.
+
+_PREFIX = 1 << 12
+
+_space  = _re.compile(rb"\s*")
+_scalar = _re.compile(rb"[^,}\]\s]*")
+_nested = _re.compile(rb'["{}\[\]]')
+_string = _re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+
+def _project(line, keys, quoted = ()):
+
+    head = line[:_PREFIX]
+    head = head.encode("utf-8") if isinstance(head, str) else head
+
+    # Parse the beginning of the line only if all keys can be found there.
+
+    if len(line) <= _PREFIX or all(key in head for key in quoted):
+
+        try:
+
+            return _projecthead(head, keys)
+
+        except ValueError:
+
+            if len(line) <= _PREFIX:
+
+                raise
+
+    entry = _json.loads(line)
+
+    if not isinstance(entry, dict):
+
+        raise ValueError("Expected a JSON object")
+
+    return {key: entry[key] for key in keys if key in entry}
+
+
+def _projecthead(line, keys):
+
+    # Projection of a line (bytes) that may be cut short, in which case
+    # a ValueError is raised unless all keys come before the cut.
+
+    entry = {}
+
+    i = _space.match(line).end()
+
+    if line[i : i + 1] != b"{":
+
+        raise ValueError("Expected a JSON object")
+
+    i += 1
+
+    while len(entry) < len(keys):
+
+        i = _space.match(line, i).end()
+        c = line[i : i + 1]
+
+        if c == b"}":
+
+            break
+
+        if c == b",":
+
+            i += 1
+            continue
+
+        end = _skipvalue(line, i)
+        key = _json.loads(line[i : end])
+
+        i = _space.match(line, end).end()
+
+        if line[i : i + 1] != b":":
+
+            raise ValueError("Expected ':' after key")
+
+        i   = _space.match(line, i + 1).end()
+        end = _skipvalue(line, i)
+
+        if key in keys:
+
+            entry[key] = _json.loads(line[i : end])
+
+        i = end
+
+    return entry
+
+
+def _skipvalue(line, i):
+
+    # Index just past the JSON value starting at line[i].
+
+    c = line[i : i + 1]
+
+    if c == b'"':
+
+        return _skipstring(line, i)
+
+    if not c or c not in b"{[":
+
+        end = _scalar.match(line, i).end()
+
+        if end == i or end == len(line):
+
+            raise ValueError("Expected a JSON value")
+
+        return end
+
+    depth = 0
+
+    while True:
+
+        match = _nested.search(line, i)
+
+        if match is None:
+
+            raise ValueError("Unterminated JSON value")
+
+        c = match.group()
+
+        if c == b'"':
+
+            i = _skipstring(line, match.start())
+            continue
+
+        depth += 1 if c in b"{[" else -1
+        i = match.end()
+
+        if depth == 0:
+
+            return i
+
+
+def _skipstring(line, i):
+
+    # Index just past the JSON string starting at line[i].
+
+    match = _string.match(line, i)
+
+    if match is None:
+
+        raise ValueError("Unterminated JSON string")
+
+    return match.end()
+
+
+def _merge(spans, parts):
+
+    # Join neighbouring (offset, length) spans into about parts spans.
+
+    target = sum(length for _, length in spans) / max(1, parts)
+    merged = []
+
+    for offset, length in spans:
+
+        if merged and merged[-1][1] < target:
+
+            start, size = merged[-1]
+            merged[-1]  = (start, size + length)
+
+        else:
+
+            merged.append((offset, length))
+
+    return merged
+
+
+def _ordered(executor, function, items, window):
+
+    # Like executor.map, but never more than window items ahead.
+
+    pending = _collections.deque()
+
+    for item in items:
+
+        pending.append(executor.submit(function, item))
+
+        if len(pending) >= window:
+
+            yield pending.popleft().result()
+
+    while pending:
+
+        yield pending.popleft().result()
+
+
+# Convenience functions.
+
+
+def read(*args, **kwargs):
+
+    """
+
+    Read a full uncompressed JSON lines file into memory.
+
+    """
+
+    kwargs["bzip"] = False
+    kwargs["gzip"] = False
+    kwargs["xz"]   = False
+    kwargs["zstd"] = False
+
+    with open(*args, **kwargs) as f:
+
+        return f.read()
+
+
+def bzread(*args, **kwargs):
+
+    """
+
+    Read a full bzip2-compressed JSON lines file into memory.
+
+    """
+
+    kwargs["bzip"] = True
+    kwargs["gzip"] = False
+    kwargs["xz"]   = False
+    kwargs["zstd"] = False
+
+    with open(*args, **kwargs) as f:
+
+        return f.read()
+
+
+def gzread(*args, **kwargs):
+
+    """
+
+    Read a full gzip-compressed JSON lines file into memory.
+
+    """
+
+    kwargs["bzip"] = False
+    kwargs["gzip"] = True
+    kwargs["xz"]   = False
+    kwargs["zstd"] = False
+
+    with open(*args, **kwargs) as f:
+
+        return f.read()
+
+
+def xzread(*args, **kwargs):
+
+    """
+
+    Read a full xz/lzma-compressed JSON lines file into memory.
+
+    """
+
+    kwargs["bzip"] = False
+    kwargs["gzip"] = False
+    kwargs["xz"]   = True
+    kwargs["zstd"] = False
+
+    with open(*args, **kwargs) as f:
+
+        return f.read()
+
+
+def zstread(*args, **kwargs):
+
+    """
+
+    Read a full zstd-compressed JSON lines file into memory.
+
+    """
+
+    kwargs["bzip"] = False
+    kwargs["gzip"] = False
+    kwargs["xz"]   = False
+    kwargs["zstd"] = True
 
     with open(*args, **kwargs) as f:
 
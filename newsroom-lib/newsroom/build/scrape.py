@@ -1,11 +1,14 @@
 ################################################################################
 
 import click
+import collections
 import os.path
 
 from tqdm import tqdm
 
-from . import Downloader
+from . import Downloader, AsyncDownloader
+from .compact import compact
+from .journal import Journal
 from newsroom import jsonl
 
 import random
@@ -75,7 +78,21 @@ archive_file = click.Path(
     "--workers",
     type = int,
     default = 16,
-    help = "Number of threads to use. [default = 16]",
+    help = "Number of threads; with --sleep, sets the starting rate. [default = 16]",
+)
+
+@click.option(
+    "--engine",
+    type = click.Choice(["threads", "async"]),
+    default = "threads",
+    help = "Download with a thread pool or asyncio. [default = threads]",
+)
+
+@click.option(
+    "--concurrency",
+    type = int,
+    default = 200,
+    help = "Requests in flight with --engine async. [default = 200]",
 )
 
 @click.option(
@@ -89,14 +106,48 @@ archive_file = click.Path(
     "--sleep",
     type = float,
     default = 2,
-    help = "Delay between downloading articles. [default = 2 sec]",
+    help = "Delay between downloading articles, per worker. [default = 2 sec]",
 )
 
 @click.option(
     "--multiplier",
     type = float,
     default = 1.5,
-    help = "Archive.org rate limiting sensitivity. [default = 1.5]",
+    help = "Rate reduction when Archive.org throttles. [default = 1.5]",
+)
+
+@click.option(
+    "--connections",
+    type = int,
+    default = None,
+    help = "Keep-alive connections per host. [default = --workers]",
+)
+
+@click.option(
+    "--per-host",
+    type = int,
+    default = None,
+    help = "Downloads in flight per host. [default = no limit]",
+)
+
+@click.option(
+    "--max-size",
+    type = float,
+    default = 5,
+    help = "Skip pages larger than this many MB, 0 for no limit. [default = 5]",
+)
+
+@click.option(
+    "--html-only/--any-type",
+    default = True,
+    help = "Skip pages that are not served as HTML. [default = html-only]",
+)
+
+@click.option(
+    "--compact",
+    "compact_pages",
+    is_flag = True,
+    help = "Drop scripts, styles and comments. [default = off]",
 )
 
 @click.option(
@@ -105,30 +156,25 @@ archive_file = click.Path(
     help = "Check remaining URLs to download. [default = off]",
 )
 
+@click.option(
+    "--zstd",
+    is_flag = True,
+    help = "Compress the archive with zstd instead of gzip. [default = off]",
+)
+
 ################################################################################
 
-def main(urls, thin, archive, exactness, diff, **downloader_args):
+def main(urls, thin, archive, exactness, diff, zstd, engine, concurrency,
+         workers, max_size, compact_pages, **downloader_args):
 
     if not urls and not thin:
 
         print("Either --urls or --thin must be defined.")
         return
 
-    # If the archive file exists, only download what we need.
-    # Open the file and read all previously downloaded URLs.
-
-    if not os.path.isfile(archive):
-
-        done = {}
-
-    else:
-
-        print("Loading previously downloaded summaries:", end = " ")
-
-        with jsonl.open(archive, gzip = True) as f:
+    # Archive compression (gzip blocks unless --zstd).
 
-            done = {ln["archive"] for ln in f}
-            print(len(done), "downloaded summaries...", end = " ")
+    codec = {"zstd": True} if zstd else {"gzip": True, "blocks": True}
 
     # Read the URL file or thin.
 
@@ -142,22 +188,49 @@ def main(urls, thin, archive, exactness, diff, **downloader_args):
 
         with jsonl.open(thin, gzip = True) as f:
 
-            urls = [entry["archive"] for entry in f]
+            urls = [entry["archive"] for entry in f.readlines(keys = ["archive"])]
+
+    # If the archive file exists, only download what we need.
+    # Previously downloaded URLs are looked up in the archive's key table
+    # (ARCHIVE.keys), which is only rebuilt when the archive has changed.
+
+    if os.path.isfile(archive):
+
+        print("Loading previously downloaded summaries:", end = " ")
+
+        with jsonl.open(archive, key = "archive", **codec) as f:
+
+            todo = [url for url in urls if url not in f]
+            print(len(urls) - len(todo), "downloaded summaries...", end = " ")
+
+    else:
+
+        todo = list(urls)
 
     # Which URLs are remaining?
 
-    todo = [url for url in urls if url not in done]
     size = round(0.00002 * len(todo), 1)
 
     # If --diff argument is enabled, just print undownloaded article URLs.
 
+    # The journal (ARCHIVE.journal) records how every earlier download
+    # ended, so failures are known without retrying or rescanning them.
+
+    journal = Journal(archive + ".journal")
+
     if diff:
 
-        print("there are", len(todo), "URLs not downloaded:\n")
+        outcomes = collections.Counter(
+            journal.get(url)["outcome"] if url in journal else "untried"
+            for url in todo)
+
+        print("there are", len(todo), "URLs not downloaded",
+              "(" + ", ".join(k + ": " + str(v) for k, v in outcomes.items()) + "):\n")
 
         for url in todo:
             print(url)
 
+        journal.close()
         return
 
     else:
@@ -171,15 +244,56 @@ def main(urls, thin, archive, exactness, diff, **downloader_args):
         exactness_map = {_exactness(url, exactness): url for url in todo}
         todo = list(exactness_map.keys())
 
+    # Retry earlier failures first, if they can be retried and their
+    # backoff has passed. Permanent failures (e.g. 404) are skipped, and
+    # pages refused for their size or type only come back once --max-size
+    # or --any-type would accept them.
+
+    max_size = int(max_size * 2 ** 20) or None
+    html_only = downloader_args["html_only"]
+
+    retry = [
+        url for url in todo
+        if url in journal and journal.due(
+            url, max_size = max_size, html_only = html_only)
+    ]
+    fresh = [url for url in todo if url not in journal]
+    held = len(todo) - len(retry) - len(fresh)
+
+    if retry or held:
+
+        print(len(retry), "failed pages to retry,", held, "skipped",
+              "(permanent failures or still backing off).")
+
     # Randomize todo to prevent "hard" pages from collecting at start.
 
-    random.shuffle(todo)
+    random.shuffle(retry)
+    random.shuffle(fresh)
+
+    todo = retry + fresh
 
     # Initialize the Archive scraper to start downloading.
 
     print("If pages fail to download now, re-run script when finished.\n")
 
-    scraper = Downloader(**downloader_args)
+    # Pages that decode cleanly in their declared charset are stored as
+    # text. The rest are stored undecoded with their declared encoding,
+    # and only decoded by newsroom-extract.
+
+    downloader_args["raw"] = True
+    downloader_args["max_size"] = max_size
+
+    if engine == "async":
+
+        scraper = AsyncDownloader(
+            concurrency = concurrency, workers = workers, journal = journal,
+            **downloader_args)
+
+    else:
+
+        scraper = Downloader(
+            workers = workers, journal = journal, **downloader_args)
+
     downloads = scraper.download(todo)
 
     # Progress bar arguments.
@@ -197,7 +311,7 @@ def main(urls, thin, archive, exactness, diff, **downloader_args):
 
     try:
 
-        with jsonl.open(archive, gzip = True) as f:
+        with jsonl.open(archive, key = "archive", **codec) as f:
 
             for article in downloads:
 
@@ -228,15 +342,35 @@ def main(urls, thin, archive, exactness, diff, **downloader_args):
                         article["exactness_archive"] = exactness_archive
                         article["archive"] = real_archive
 
+                    # Drop the parts of the page extraction never reads.
+
+                    if compact_pages:
+
+                        article = compact(article)
+
                     # Write updated dictionary to JSON file.
 
                     f.appendline(article)
 
+                # Show the current rate allowed over all hosts.
+
+                rate = scraper.rate()
+
+                if rate is not None:
+
+                    progress.set_postfix(
+                        rate = "{:.1f}/s".format(rate),
+                        refresh = False)
+
                 progress.update(1)
 
         if errors > 0:
 
+            failures = {k: v for k, v in journal.counts.items() if k != "ok"}
+
             print("\n\nRerun the script:", errors, "pages failed to download.")
+            print("- Failures by class:", failures)
+            print("- Reruns retry only failures that can succeed later.")
             print("- Try running with a lower --workers count (default = 16).")
             print("- Check which URLs are left with the --diff flag.")
             print("- Last resort: --exactness X to truncate dates to X digits.")
@@ -251,5 +385,18 @@ def main(urls, thin, archive, exactness, diff, **downloader_args):
         print("\n\nDownload aborted with progress preserved.")
         print("Run script again to resume from this point.")
 
+    finally:
+
+        # Stop queued downloads; finished pages are already written.
+
+        downloads.close()
+
+        stats = scraper.stats()
+        scraper.close()
+        journal.close()
+
+        print("Connections:", stats["misses"], "opened,",
+              stats["hits"], "reused for", stats["requests"], "requests.")
+
 ################################################################################
 
@@ -0,0 +1,180 @@
+################################################################################
+
+import math as _math
+import os   as _os
+
+import numpy  as _np
+import pandas as _pd
+
+################################################################################
+
+_measures = ("compression", "coverage", "density")
+
+
+def path(scores):
+
+    """
+
+    Path of the columnar sidecar kept next to a scores file.
+
+    """
+
+    return scores + ".npz"
+
+
+class Columns(object):
+
+    """
+
+    Collects the numeric and binned columns of scored summaries and saves
+    them as a NumPy .npz file next to the scores file. ROUGE scores and
+    measures are stored as float64 (NaN when missing), bins as int8 codes
+    into a sorted list of labels (-1 when missing). Reference and system
+    summaries and other string fields are not kept.
+
+    Example:
+
+        >>> columns = Columns()
+        >>> columns.extend(results)
+        >>> columns.save("textrank.scores")
+        >>> df = load("textrank.scores")
+
+    """
+
+    def __init__(self):
+
+        self.rows   = 0
+        self.values = {}
+
+
+    @staticmethod
+    def _keep(key):
+
+        return key.startswith("rouge_") \
+            or key in _measures \
+            or key.endswith("_bin")
+
+
+    def append(self, row):
+
+        """
+
+        Add the columns of a single scored summary.
+
+        """
+
+        for key in row:
+
+            if key not in self.values and self._keep(key):
+
+                self.values[key] = [None] * self.rows
+
+        for key, column in self.values.items():
+
+            column.append(row.get(key))
+
+        self.rows += 1
+
+
+    def extend(self, rows):
+
+        """
+
+        Add the columns of several scored summaries.
+
+        """
+
+        for row in rows:
+
+            self.append(row)
+
+
+    def save(self, scores):
+
+        """
+
+        Write the columns for the given (already closed) scores file.
+
+        """
+
+        arrays = {}
+
+        for key, column in self.values.items():
+
+            if key.endswith("_bin"):
+
+                labels = sorted({v for v in column if v is not None})
+                codes  = {label: c for c, label in enumerate(labels)}
+
+                arrays[key] = _np.array(
+                    [codes.get(v, -1) for v in column],
+                    dtype = _np.int8)
+
+                arrays[key + ".labels"] = _np.array(labels, dtype = str)
+
+            else:
+
+                arrays[key] = _np.array(
+                    [_math.nan if v is None else v for v in column],
+                    dtype = _np.float64)
+
+        # Remember which scores file these columns belong to.
+
+        arrays[".source"] = _np.array(
+            [_os.path.getsize(scores), self.rows],
+            dtype = _np.int64)
+
+        with open(path(scores), "wb") as f:
+
+            _np.savez(f, **arrays)
+
+
+def load(scores):
+
+    """
+
+    Load the columnar sidecar of a scores file as a DataFrame.
+
+    Returns:
+
+        pandas DataFrame, or None if the sidecar is missing or was written
+        for a different version of the scores file
+
+    """
+
+    try:
+
+        data = _np.load(path(scores))
+
+    except OSError:
+
+        return None
+
+    with data:
+
+        size, rows = data[".source"]
+
+        if size != _os.path.getsize(scores):
+
+            return None
+
+        columns = {}
+
+        for key in data.files:
+
+            if key.startswith(".") or key.endswith(".labels"):
+
+                continue
+
+            if key + ".labels" in data.files:
+
+                columns[key] = _pd.Categorical.from_codes(
+                    data[key], categories = list(data[key + ".labels"]))
+
+            else:
+
+                columns[key] = data[key]
+
+    return _pd.DataFrame(columns, index = _pd.RangeIndex(rows))
+
+################################################################################
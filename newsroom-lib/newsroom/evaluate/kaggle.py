@@ -4,6 +4,8 @@ import json, bz2, click
 from newsroom import jsonl
 import pandas as pd
 
+from . import columns
+
 ################################################################################
 
 scores_file = click.Path(
@@ -56,7 +58,11 @@ submission_file = click.Path(
 
 def main(scores, submission, rouge, variant):
 
-    df = pd.DataFrame(jsonl.gzread(scores))
+    df = columns.load(scores)
+
+    if df is None:
+
+        df = pd.DataFrame(jsonl.gzread(scores))
 
     rouge_score = df[f"rouge_{rouge}_{variant}"].mean()
     hack_score = (1 - rouge_score ** 2) ** (1/2) - 1 
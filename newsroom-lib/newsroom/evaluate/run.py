@@ -90,7 +90,7 @@ def main(system, dataset, summaries, keys):
 
     )
 
-    dataset_file = jsonl.open(dataset, gzip = True)
+    dataset_file = jsonl.open(dataset, gzip = True, index = True)
 
     # Check the size of the dataset.
     # As a sanity check and for the progress bar.
@@ -118,7 +118,7 @@ def main(system, dataset, summaries, keys):
 
     is_json = True
 
-    with jsonl.open(summaries, gzip = True) as summaries_file:
+    with jsonl.open(summaries, gzip = True, index = True) as summaries_file:
 
         summaries_file.delete()
 
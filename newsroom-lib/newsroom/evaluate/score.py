@@ -11,6 +11,7 @@ from multiprocessing import cpu_count
 from concurrent.futures import ProcessPoolExecutor
 
 from .compute_rouge import *
+from .columns import Columns
 
 ################################################################################
 
@@ -92,9 +93,9 @@ output_file = click.Path(
 def main(dataset, summaries, scores, rouge, stemmed, workers, chunksize):
     rouges = rouge.upper().split(",")
 
-    with jsonl.open(dataset, gzip = True) as a:
-        with jsonl.open(summaries, gzip = True) as s:
-            with jsonl.open(scores, gzip = True) as f:
+    with jsonl.open(dataset, gzip = True, workers = workers) as a:
+        with jsonl.open(summaries, gzip = True, index = True) as s:
+            with jsonl.open(scores, gzip = True, index = True, blocks = True) as f:
 
                 # If scores file exists, delete it.
                 # (So we write, rather than appending.)
@@ -103,6 +104,10 @@ def main(dataset, summaries, scores, rouge, stemmed, workers, chunksize):
                 size = len(s)
                 chunk = []
 
+                # Numeric and bin columns for newsroom-tables.
+
+                columns = Columns()
+
                 with tqdm(total = size, desc = "Evaluating") as progress:
 
                     def process_chunk():
@@ -112,6 +117,7 @@ def main(dataset, summaries, scores, rouge, stemmed, workers, chunksize):
                             results = list(ex.map(compute_rouge, chunk))
 
                             f.append(results)
+                            columns.extend(results)
                             progress.update(len(results))
 
                     for aline, sline in zip(a, s):
@@ -125,6 +131,8 @@ def main(dataset, summaries, scores, rouge, stemmed, workers, chunksize):
 
                     process_chunk()
 
+    columns.save(scores)
+
     aggregate = {}
     with jsonl.open(scores, gzip = True) as f:
 
@@ -4,6 +4,8 @@ import json, bz2, click
 from newsroom import jsonl
 import pandas as pd
 
+from . import columns
+
 ################################################################################
 
 scores_file = click.Path(
@@ -53,7 +55,13 @@ def main(scores, rouge, variants, bins):
     rouge    = [f"ROUGE {r}" for r in rouge.split(",")]
     variants = [v.title().replace("Fscore", "F-Score") for v in variants.split(",")]
 
-    df = pd.DataFrame(jsonl.gzread(scores))
+    # Prefer the compact columns written by newsroom-score.
+
+    df = columns.load(scores)
+
+    if df is None:
+
+        df = pd.DataFrame(jsonl.gzread(scores))
 
     df.columns = [
         column
@@ -69,7 +77,7 @@ def main(scores, rouge, variants, bins):
         for b in bins:
 
             rouge_variants = [r + " " + v for v in variants]
-            print(df.groupby(b)[rouge_variants].mean() * 100)
+            print(df.groupby(b, observed = True)[rouge_variants].mean() * 100)
             print()
 
 ################################################################################
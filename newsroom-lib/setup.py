@@ -37,6 +37,11 @@ setup(
         "ujson>=1.35",
     ],
 
+    extras_require = {
+        "zstd": ["zstandard>=0.15"],
+        "async": ["aiohttp>=3.5"],
+    },
+
     entry_points = {
         "console_scripts": [
             "newsroom-scrape=newsroom.build.scrape:main",
@@ -45,6 +50,9 @@ setup(
             "newsroom-score=newsroom.evaluate.score:main",
             "newsroom-tables=newsroom.evaluate.tables:main",
             "newsroom-kaggle=newsroom.evaluate.kaggle:main",
+            "newsroom-dictionary=newsroom.build.dictionary:main",
+            "newsroom-compact=newsroom.build.compact:main",
+            "newsroom-cdx=newsroom.build.cdx:main",
         ]
     },
 
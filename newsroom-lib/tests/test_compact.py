@@ -0,0 +1,86 @@
+################################################################################
+
+from newsroom.build import Article
+from newsroom.build.compact import compact, compact_html
+
+################################################################################
+
+_sentence = "Regeringen fremlagde i dag en plan for den grønne omstilling af landbruget."
+
+_page = """<!DOCTYPE html>
+<html>
+<head>
+<title>Ny plan for landbruget - Avisen</title>
+<meta name="description" content="Regeringen vil omstille landbruget.">
+<link rel="canonical" href="http://avisen.dk/plan">
+<script>var ads = "<p>" + "</p>"; // <!-- not a comment --></script>
+<style type="text/css">p > a { color: red }</style>
+<!-- <meta name="description" content="Commented out."> -->
+</head>
+<body>
+<script src="app.js"></script>
+<div class="article">
+<h1>Ny plan for landbruget</h1>
+<p>{s} <!-- Editor: check the numbers. --> {s}</p>
+<p>{s} <svg width="10" height="10"><title>Figur med tal for landbruget i hele landet</title>
+<circle r="4"/></svg> {s}</p>
+<figure><svg viewBox="0 0 100 20"><text x="0" y="10">Udledning fra landbruget er faldet med en tredjedel</text></svg></figure>
+<p>{s}</p>
+<style>.article { margin: 0 }</style>
+<p>{s} {s}</p>
+</div>
+<script type="text/javascript">
+document.write("<p>" + "Denne tekst er skrevet af et script og ikke af avisen." + "</p>");
+</script>
+</body>
+</html>
+""".replace("{s}", _sentence)
+
+################################################################################
+
+def test_compact_keeps_article():
+
+    compacted = compact({"archive": "http://avisen.dk/plan", "html": _page})
+
+    assert "<script" not in compacted["html"]
+    assert "<style" not in compacted["html"]
+    assert "<!--" not in compacted["html"]
+    assert "<svg" in compacted["html"]
+
+    original = Article.process({"archive": "http://avisen.dk/plan", "html": _page})
+
+    assert original["text"]
+    assert original["summary"] == "Regeringen vil omstille landbruget."
+    assert Article.process(compacted) == original
+    assert Article.process(compacted, head_only = True) == \
+        Article.process({"archive": "http://avisen.dk/plan", "html": _page},
+                        head_only = True)
+
+
+def test_compact_keeps_svg_text():
+
+    html = "<p>Tal <svg><title>Figur</title><text>42 procent</text></svg></p>"
+
+    assert compact_html(html) == html
+
+
+def test_compact_unclosed():
+
+    html = "<p>Tekst</p><script>var x = 1;"
+
+    assert compact_html(html) == html
+
+
+def test_compact_raw_page_encoding():
+
+    # Raw pages without a declared encoding keep the one detected on the
+    # whole page, before scripts and comments are dropped.
+
+    body = ("<p>" + _sentence + "</p>").encode("utf-8") * 20
+    page = {"archive": "http://avisen.dk/plan", "html": body.decode("latin-1"),
+            "encoding": None}
+
+    assert compact(page)["encoding"] is not None
+    assert "encoding" not in compact({"html": "<p>x</p>"})
+
+################################################################################
@@ -0,0 +1,331 @@
+################################################################################
+
+import asyncio
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from newsroom.build import download
+from newsroom.build.journal import Journal
+
+################################################################################
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+
+        body = b"<html><body><p>" + self.path.encode() + b"</p></body></html>"
+        kind = "text/html; charset=utf-8"
+
+        if self.path.startswith("/big"):
+
+            body *= 1000
+
+        elif self.path.startswith("/pdf"):
+
+            kind = "application/pdf"
+
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *_):
+
+        pass
+
+
+@pytest.fixture
+def server():
+
+    # Bound to all addresses, so 127.0.0.1, 127.0.0.2, ... are separate
+    # hosts for the connection pools.
+
+    httpd  = ThreadingHTTPServer(("0.0.0.0", 0), _Handler)
+    thread = threading.Thread(target = httpd.serve_forever, daemon = True)
+    thread.start()
+
+    yield httpd.server_address[1]
+
+    httpd.shutdown()
+    httpd.server_close()
+
+################################################################################
+
+# Connection pools.
+
+def test_pool_sizes():
+
+    downloader = download.Downloader(workers = 4, connections = 3)
+    adapter    = downloader.session.get_adapter("http://example.dk")
+
+    assert adapter.poolmanager.pools._maxsize == download._HOSTS
+    assert adapter._pool_maxsize == 3
+
+    downloader.close()
+
+
+def test_stats_include_closed_pools(server, monkeypatch):
+
+    # Room for two hosts, so downloading from four evicts pools.
+
+    monkeypatch.setattr(download, "_HOSTS", 2)
+
+    urls = [
+        "http://127.0.0.{}:{}/{}".format(host, server, page)
+        for host in range(1, 5)
+        for page in range(3)
+    ]
+
+    downloader = download.Downloader(workers = 1, sleep = 0)
+    pages      = list(downloader.download(urls))
+
+    assert sorted(page["url"] for page in pages) == sorted(urls)
+
+    # Evicted pools still count.
+
+    stats = downloader.stats()
+
+    assert stats["requests"] == len(urls)
+    assert stats["hits"] + stats["misses"] == len(urls)
+
+    downloader.close()
+
+    assert downloader.stats() == stats
+
+    # With a pool for every host, each host needs one connection.
+
+    monkeypatch.setattr(download, "_HOSTS", 4)
+
+    downloader = download.Downloader(workers = 1, sleep = 0)
+    pages      = list(downloader.download(urls))
+
+    assert downloader.stats() == {
+        "requests": len(urls),
+        "connections": 4,
+        "hits": len(urls) - 4,
+        "misses": 4,
+    }
+
+    downloader.close()
+
+################################################################################
+
+# Host cooldown.
+
+def test_concurrent_failures_back_off_once():
+
+    urls      = ["http://a.dk/{}".format(i) for i in range(30)]
+    scheduler = download.Scheduler(urls, cooldown = 0.2)
+    taken     = [scheduler.next()[0] for _ in range(20)]
+
+    # A burst of 429s from downloads that were in flight together.
+
+    for url in taken:
+
+        scheduler.finish(url, "throttled")
+
+    host = scheduler.hosts["a.dk"]
+
+    assert host.failures == 1
+    assert host.until - time.monotonic() <= 0.2
+    assert scheduler.poll()[0] is None
+
+    # The next download after the rest fails again: one more step.
+
+    url, _ = scheduler.next()
+    scheduler.finish(url, "throttled")
+
+    assert host.failures == 2
+    assert 0.2 < host.until - time.monotonic() <= 0.4
+
+    # A success resets the host, unless it was sent before the rest.
+
+    url, _ = scheduler.next()
+    late, _ = scheduler.next()
+
+    scheduler.finish(url, "timeout")
+    scheduler.finish(late, "ok")
+
+    assert host.failures == 3
+
+    url, _ = scheduler.next()
+    scheduler.finish(url, "ok")
+
+    assert host.failures == 0
+
+
+def test_retry_after_from_earlier_downloads():
+
+    scheduler = download.Scheduler(["http://a.dk/1", "http://a.dk/2"])
+    first, _  = scheduler.next()
+    second, _ = scheduler.next()
+
+    scheduler.finish(first, "throttled")
+    scheduler.finish(second, "throttled", retry_after = 30)
+
+    host = scheduler.hosts["a.dk"]
+
+    assert host.failures == 1
+    assert host.until - time.monotonic() > 29
+
+################################################################################
+
+# Asyncio engine.
+
+def _urls(server, count):
+
+    return ["http://127.0.0.1:{}/{}".format(server, i) for i in range(count)]
+
+
+def test_async_download(server):
+
+    pytest.importorskip("aiohttp")
+
+    downloader = download.AsyncDownloader(concurrency = 4, sleep = 0)
+    urls       = _urls(server, 20)
+    pages      = list(downloader.download(urls))
+
+    assert sorted(page["url"] for page in pages) == sorted(urls)
+
+
+def test_async_starting_rate():
+
+    # Both engines start equally fast, whatever the concurrency.
+
+    pytest.importorskip("aiohttp")
+
+    threads = download.Downloader(workers = 16, sleep = 2)
+
+    for concurrency in (10, 200, 1000):
+
+        engine = download.AsyncDownloader(
+            concurrency = concurrency, workers = 16, sleep = 2)
+
+        assert engine.limiter.rate == threads.limiter.rate == 8
+
+    assert download.AsyncDownloader().limiter.rate == \
+        download.Downloader().limiter.rate
+
+    threads.close()
+
+def test_async_cancel_with_full_queue(server):
+
+    # Nobody reads the full results queue while the downloads finish, as
+    # when the consumer of download() stops. Cancelling must still return.
+
+    pytest.importorskip("aiohttp")
+
+    downloader = download.AsyncDownloader(concurrency = 2, sleep = 0)
+    scheduler  = download._schedule(downloader, _urls(server, 20))
+
+    async def stalled():
+
+        results = asyncio.Queue(1)
+        results.put_nowait(None)
+
+        main = asyncio.ensure_future(downloader._main(scheduler, results))
+
+        await asyncio.sleep(0.5)
+        main.cancel()
+
+        await asyncio.wait_for(asyncio.wait([main]), 5)
+
+        return main
+
+    loop = asyncio.new_event_loop()
+
+    try:
+
+        assert loop.run_until_complete(stalled()).cancelled()
+
+    finally:
+
+        loop.close()
+
+
+def test_async_close_generator(server):
+
+    pytest.importorskip("aiohttp")
+
+    downloader = download.AsyncDownloader(concurrency = 2, sleep = 0)
+    downloads  = downloader.download(_urls(server, 50))
+
+    def consume():
+
+        next(downloads)
+        downloads.close()
+
+    thread = threading.Thread(target = consume, daemon = True)
+    thread.start()
+    thread.join(10)
+
+    assert not thread.is_alive()
+
+################################################################################
+
+# Refused pages.
+
+def test_refused_pages_journaled(server, tmp_path):
+
+    journal    = Journal(str(tmp_path / "archive.journal"))
+    downloader = download.Downloader(
+        workers = 2, sleep = 0, max_size = 1000, journal = journal)
+
+    base  = "http://127.0.0.1:{}/".format(server)
+    pages = list(downloader.download([base + "page", base + "big", base + "pdf"]))
+
+    assert len([page for page in pages if page]) == 1
+
+    assert journal.get(base + "big")["outcome"] == "too_large"
+    assert journal.get(base + "big")["limit"] == 1000
+    assert journal.get(base + "pdf")["outcome"] == "not_html"
+
+    assert not journal.due(base + "big", max_size = 1000)
+    assert journal.due(base + "big", max_size = 100000)
+    assert journal.due(base + "pdf", max_size = 1000, html_only = False)
+
+    downloader.close()
+    journal.close()
+
+################################################################################
+
+# Stored page text.
+
+_danish = "<p>Blåbærgrød på Østerbro</p>".encode("utf-8")
+
+
+@pytest.mark.parametrize("kind, stored", [
+    ("text/html; charset=utf-8", {"html": _danish.decode("utf-8")}),
+    ("text/html; charset=windows-1252", {"html": _danish.decode("cp1252")}),
+    ("text/html; charset=ascii", {"encoding": "ascii"}),
+    ("text/html; charset=unknown", {"encoding": "unknown"}),
+    ("application/xhtml+xml", {"encoding": None}),
+])
+def test_raw_pages(kind, stored):
+
+    # Pages that decode in their declared charset are stored as text, the
+    # rest undecoded. Both give back what requests would have decoded.
+
+    headers = {"content-type": kind}
+    page    = download._page("http://x.dk", _danish, headers, raw = True)
+
+    for key, value in stored.items():
+
+        assert page[key] == value
+
+    if "encoding" in page:
+
+        assert page["html"] == _danish.decode("latin-1")
+
+    assert download.decode_html(page) == \
+        download.decode_html(download._page("http://x.dk", _danish, headers, False))
+
+################################################################################
@@ -0,0 +1,37 @@
+################################################################################
+
+from newsroom.build import Article
+
+################################################################################
+
+def test_head_tags():
+
+    html = (
+        '<html><head><title>Titel</title>'
+        '<meta name="description" content="Resume.">'
+        '<link rel="canonical" href="http://avisen.dk/a">'
+        '</head><body><meta name="description" content="Body.">'
+        + "<p>Tekst</p>" * 10000 + "</body></html>"
+    )
+
+    tags = Article.head(html, chunk = 64)
+
+    assert sorted(tags) == ["link", "meta"]
+    assert [meta.get("content") for meta in tags["meta"]] == ["Resume."]
+    assert [link.get("href") for link in tags["link"]] == ["http://avisen.dk/a"]
+
+
+def test_head_only_summary():
+
+    page = {
+        "archive": "http://avisen.dk/a",
+        "html": '<html><head><meta property="og:description" content="Resume.">'
+                "</head><body>" + "<p>Fem ord i en sætning her.</p>" * 5
+                + "</body></html>",
+    }
+
+    assert Article.process(page, head_only = True)["summary"] == "Resume."
+    assert Article.process({"html": "<html><head></head><body><p>x</p>"},
+                           head_only = True) is None
+
+################################################################################
@@ -0,0 +1,157 @@
+################################################################################
+
+import threading
+
+import ujson
+
+from newsroom.build.journal import Journal
+
+################################################################################
+
+def test_record_and_reload(tmp_path):
+
+    path    = str(tmp_path / "archive.journal")
+    journal = Journal(path)
+
+    journal.record("http://a.dk", "missing", status = 404)
+    journal.record("http://b.dk", "timeout")
+    journal.record("http://b.dk", "timeout", attempts = 2)
+    journal.close()
+
+    journal = Journal(path)
+
+    assert journal.get("http://a.dk")["status"] == 404
+    assert journal.get("http://b.dk")["attempts"] == 3
+    assert not journal.due("http://a.dk")
+    assert journal.due("http://c.dk")
+
+    journal.close()
+
+
+def test_record_after_close(tmp_path):
+
+    # Worker threads may still finish downloads while the journal closes.
+
+    path    = str(tmp_path / "archive.journal")
+    journal = Journal(path)
+    errors  = []
+    started = threading.Barrier(5)
+
+    def worker(n):
+
+        started.wait()
+
+        try:
+
+            for i in range(2000):
+
+                journal.record("http://{}.dk/{}".format(n, i), "ok", 200)
+
+        except Exception as error:
+
+            errors.append(error)
+
+    threads = [threading.Thread(target = worker, args = (n,)) for n in range(4)]
+
+    for thread in threads:
+
+        thread.start()
+
+    started.wait()
+    journal.close()
+
+    for thread in threads:
+
+        thread.join()
+
+    assert errors == []
+
+    with open(path) as f:
+
+        lines = [ujson.loads(line) for line in f]
+
+    assert len(lines) == len(Journal(path).ok)
+
+
+def test_partial_last_line(tmp_path):
+
+    # A run killed while writing a record leaves part of a line.
+
+    path    = str(tmp_path / "archive.journal")
+    journal = Journal(path)
+
+    journal.record("http://a.dk", "missing", status = 404)
+    journal.close()
+
+    with open(path, "a") as f:
+
+        f.write('{"url": "http://b.dk", "outc')
+
+    journal = Journal(path)
+    journal.record("http://c.dk", "timeout")
+    journal.close()
+
+    journal = Journal(path)
+
+    assert "http://a.dk" in journal
+    assert "http://b.dk" not in journal
+    assert journal.get("http://c.dk")["outcome"] == "timeout"
+
+    journal.close()
+
+
+def test_successes_keep_only_urls(tmp_path):
+
+    path    = str(tmp_path / "archive.journal")
+    journal = Journal(path)
+
+    journal.record("http://a.dk", "timeout")
+    journal.record("http://a.dk", "ok", 200)
+    journal.record("http://b.dk", "ok", 200)
+    journal.record("http://b.dk", "missing", 404)
+    journal.close()
+
+    for journal in (journal, Journal(path)):
+
+        assert journal.last.keys() == {"http://b.dk"}
+        assert journal.ok == {"http://a.dk"}
+
+        assert "http://a.dk" in journal
+        assert journal.get("http://a.dk")["outcome"] == "ok"
+        assert journal.due("http://a.dk")
+        assert not journal.due("http://b.dk")
+
+    journal.close()
+
+################################################################################
+
+# Pages refused by the size and type limits.
+
+def test_due_after_limits_change(tmp_path):
+
+    journal = Journal(str(tmp_path / "archive.journal"))
+
+    journal.record("http://big.dk", "too_large", 200, limit = 5 << 20)
+    journal.record("http://old.dk", "too_large", 200)
+    journal.record("http://pdf.dk", "not_html", 200)
+
+    # Same settings as when they were refused.
+
+    assert not journal.due("http://big.dk", max_size = 5 << 20)
+    assert not journal.due("http://big.dk", max_size = 1 << 20)
+    assert not journal.due("http://pdf.dk", max_size = 5 << 20)
+
+    # A larger limit, no limit, or any content type.
+
+    assert journal.due("http://big.dk", max_size = 10 << 20)
+    assert journal.due("http://big.dk", max_size = None)
+    assert journal.due("http://pdf.dk", html_only = False)
+
+    # Records without a limit only come back without one.
+
+    assert not journal.due("http://old.dk", max_size = 10 << 20)
+    assert journal.due("http://old.dk", max_size = None)
+
+    journal.close()
+
+################################################################################
@@ -0,0 +1,366 @@
+################################################################################
+
+import multiprocessing
+import os
+import signal
+
+import pytest
+import ujson
+
+from newsroom.build import jsonl
+
+################################################################################
+
+def _entries(count, start = 0):
+
+    return [{"url": "http://example.dk/{}".format(i), "n": i}
+            for i in range(start, start + count)]
+
+
+def _codecs():
+
+    return [
+        {},
+        {"gzip": True},
+        {"gzip": True, "fast": False},
+        {"gzip": True, "blocks": True},
+    ]
+
+################################################################################
+
+# Line index.
+
+@pytest.mark.parametrize("codec", _codecs())
+def test_index_get_and_slice(tmp_path, codec):
+
+    path = str(tmp_path / "data.jsonl")
+    rows = _entries(2500)
+
+    # Three writer sessions, several flushes each.
+
+    for start in (0, 1000, 1700):
+
+        with jsonl.open(path, index = True, buffer = 300, **codec) as f:
+
+            f.append(rows[start : start + {0: 1000, 1000: 700, 1700: 800}[start]])
+
+    with jsonl.open(path, index = True, **codec) as f:
+
+        assert len(f) == len(rows)
+        assert f.get(0) == rows[0]
+        assert f.get(-1) == rows[-1]
+        assert f.get(1234) == rows[1234]
+        assert list(f.slice(990, 1010)) == rows[990:1010]
+        assert list(f.slice(2400)) == rows[2400:]
+
+
+def test_index_is_compact(tmp_path):
+
+    path = str(tmp_path / "data.jsonl.gz")
+
+    with jsonl.open(path, gzip = True, index = True, buffer = 100000) as f:
+
+        f.append(_entries(30000))
+
+    # One writer session is one block.
+
+    assert os.path.getsize(path + ".index") == 16
+
+    with jsonl.open(path, gzip = True, index = True) as f:
+
+        assert f.get(29999)["n"] == 29999
+
+
+def test_index_read_once(tmp_path, monkeypatch):
+
+    path = str(tmp_path / "data.jsonl")
+
+    with jsonl.open(path, index = True, buffer = 10) as f:
+
+        f.append(_entries(100))
+
+    reads = []
+    real  = jsonl._open
+
+    def counting(name, *args, **kwargs):
+
+        if name.endswith(".index"):
+
+            reads.append(name)
+
+        return real(name, *args, **kwargs)
+
+    monkeypatch.setattr(jsonl, "_open", counting)
+
+    with jsonl.open(path, index = True) as f:
+
+        for i in range(0, 100, 7):
+
+            assert f.get(i)["n"] == i
+
+        assert len(f) == 100
+
+    assert len(reads) == 1
+
+
+def test_index_extended_on_append(tmp_path):
+
+    path = str(tmp_path / "data.jsonl.gz")
+
+    with jsonl.open(path, gzip = True, index = True) as f:
+
+        f.append(_entries(10))
+        assert len(f) == 10
+
+        f.append(_entries(5, start = 10))
+        assert len(f) == 15
+        assert f.get(12)["n"] == 12
+
+
+@pytest.mark.parametrize("codec", _codecs())
+def test_index_rebuilt_when_stale(tmp_path, codec):
+
+    path = str(tmp_path / "data.jsonl")
+
+    with jsonl.open(path, index = True, **codec) as f:
+
+        f.append(_entries(50))
+
+    # Lines appended without the index, then an index in an unknown format.
+
+    with jsonl.open(path, **codec) as f:
+
+        f.append(_entries(50, start = 50))
+
+    with jsonl.open(path, index = True, **codec) as f:
+
+        assert len(f) == 100
+        assert f.get(75)["n"] == 75
+
+    with open(path + ".index", "w") as f:
+
+        f.write('{"offset": 0, "length": 12, "start": 0, "stop": 3}\n')
+
+    with jsonl.open(path, index = True, **codec) as f:
+
+        assert len(f) == 100
+        assert list(f.slice(48, 52)) == _entries(4, start = 48)
+
+################################################################################
+
+# Appending after a crash.
+
+def _killed_writer(path, codec, ready):
+
+    # Writes and flushes some lines, then hangs with the file open until
+    # it is killed.
+
+    f = jsonl.open(path, buffer = 100, **codec)
+    f.append({"n": i, "html": "<p>{}</p>".format(i) * 200} for i in range(3000))
+    f.flush()
+    ready.set()
+
+    signal.pause()
+
+
+@pytest.mark.parametrize("codec", [
+    {"gzip": True},
+    {"gzip": True, "fast": False},
+    {"bzip": True, "fast": False},
+    {"xz": True},
+    {"xz": True, "fast": False},
+    {"zstd": True},
+    {"zstd": True, "fast": False},
+])
+def test_append_after_kill(tmp_path, codec):
+
+    if codec.get("zstd") and jsonl._zstd is None:
+
+        pytest.skip("zstandard is not installed")
+
+    path    = str(tmp_path / "data.jsonl")
+    context = multiprocessing.get_context("fork")
+    ready   = context.Event()
+    writer  = context.Process(target = _killed_writer, args = (path, codec, ready))
+
+    writer.start()
+
+    assert ready.wait(60)
+
+    os.kill(writer.pid, signal.SIGKILL)
+    writer.join()
+
+    with jsonl.open(path, **codec) as f:
+
+        f.append({"n": i} for i in range(3000, 3010))
+
+    for fast in (False, True):
+
+        with jsonl.open(path, **dict(codec, fast = fast)) as f:
+
+            assert [row["n"] for row in f.readlines(keys = ["n"])] == \
+                list(range(3010))
+
+################################################################################
+
+# Key projection.
+
+def _projected(line, keys):
+
+    # Projection of a line as str and as bytes, which must agree.
+
+    load    = jsonl._loader(keys)
+    encoded = line.encode("utf-8")
+
+    assert load(line) == load(encoded)
+
+    return load(encoded)
+
+
+def _expected(line, keys):
+
+    entry = ujson.loads(line)
+
+    return {key: entry[key] for key in keys if key in entry}
+
+
+_lines = [
+    r'{"a": 1, "b": "two", "c": null}',
+    r'{"html": "<a href=\"x\">\\</a>\n\"", "url": "http://x.dk/\"q\""}',
+    r'{"k\"ey": "v", "url": "u"}',
+    r'{"nested": {"x": [1, "]}", {"y": "{"}], "z": "\\\""}, "url": "u"}',
+    r'{"list": [[], {}, [{"a": []}]], "url": [1, {"b": 2}]}',
+    r'{"text": "blåbærgrød \u00e6\u00f8\u00e5 \ud83d\ude00", "url": "æøå"}',
+    r'  {  "url" :  true ,"n":-1.5e3 , "html" : ""  }  ',
+    r'{}',
+]
+
+
+@pytest.mark.parametrize("line", _lines)
+@pytest.mark.parametrize("keys", [
+    ["url"],
+    ["url", "html"],
+    ["missing"],
+    ["a", "c", "nested", "list", "text", "n", "k\"ey"],
+])
+def test_project(line, keys):
+
+    assert _projected(line, keys) == _expected(line, keys)
+
+
+def test_project_after_long_string():
+
+    html = '<p class="x">blå \\ "quoted"</p>' * 2000
+
+    line = ujson.dumps({"url": "u", "html": html, "archive": "a", "n": 3})
+
+    assert _projected(line, ["archive"]) == {"archive": "a"}
+    assert _projected(line, ["url", "n"]) == {"url": "u", "n": 3}
+    assert _projected(line, ["html"]) == {"html": html}
+    assert _projected(line, ["missing"]) == {}
+
+
+def test_project_key_in_nested_value():
+
+    # The key appears in a nested value that is cut short.
+
+    line = ujson.dumps({
+        "meta": {"archive": "fake", "html": "x" * 10000},
+        "archive": "real",
+    })
+
+    assert _projected(line, ["archive"]) == {"archive": "real"}
+
+
+@pytest.mark.parametrize("line", [
+    '[1, 2]',
+    '{"url" "u"}',
+    '{"url": "u',
+    '{"url": [1, 2}',
+    '{"html": "' + "x" * 10000,
+])
+def test_project_invalid(line):
+
+    with pytest.raises(ValueError):
+
+        jsonl._loader(["url"])(line)
+
+
+def test_readlines_keys(tmp_path):
+
+    path = str(tmp_path / "data.jsonl.gz")
+    rows = [{"html": "<p>" * 3000, "archive": "a{}".format(i)} for i in range(20)]
+
+    with jsonl.open(path, gzip = True) as f:
+
+        f.write(rows)
+
+    with jsonl.open(path, gzip = True) as f:
+
+        assert list(f.readlines(keys = ["archive"])) == \
+            [{"archive": row["archive"]} for row in rows]
+
+################################################################################
+
+# Key table.
+
+def _statements(f):
+
+    # SQL statements run on the key table of f from now on.
+
+    statements = []
+    f._keydb().set_trace_callback(statements.append)
+
+    return statements
+
+
+@pytest.mark.parametrize("codec", _codecs())
+def test_lookups_are_read_only(tmp_path, codec):
+
+    path = str(tmp_path / "data.jsonl")
+    rows = _entries(1000)
+
+    with jsonl.open(path, key = "url", **codec) as f:
+
+        f.write(rows)
+
+    with jsonl.open(path, key = "url", **codec) as f:
+
+        statements = _statements(f)
+        modified   = os.path.getmtime(path + ".keys")
+
+        for i, row in enumerate(rows):
+
+            assert row["url"] in f
+            assert f.lookup(row["url"]) == i
+
+        assert "http://example.dk/missing" not in f
+        assert sorted(f.keys()) == sorted(row["url"] for row in rows)
+
+    assert not [s for s in statements if not s.startswith("SELECT")]
+    assert os.path.getmtime(path + ".keys") == modified
+
+
+def test_lookups_while_writing(tmp_path):
+
+    path = str(tmp_path / "data.jsonl.gz")
+
+    with jsonl.open(path, gzip = True, key = "url") as f:
+
+        f.append(_entries(10))
+        statements = _statements(f)
+
+        assert "http://example.dk/5" in f
+        assert f.is_read is False
+
+        f.append(_entries(10, start = 10))
+
+        assert f.lookup("http://example.dk/15") == 15
+        assert "COMMIT" not in statements
+
+    with jsonl.open(path, gzip = True, key = "url") as f:
+
+        assert len(f.keys()) == 20
+        assert f.get(f.lookup("http://example.dk/15"))["n"] == 15
+
+################################################################################